@@ -0,0 +1,99 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+
+
+class EwmaSeries:
+    """Exponentially weighted mean and variance of one series in constant memory."""
+
+    __slots__ = ("mean", "var", "count", "last_key")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.last_key = None
+
+    def update(self, value, alpha):
+        # Early samples get equal weight (a plain running mean) until 1/count drops below alpha
+        alpha = max(alpha, 1.0 / (self.count + 1))
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.var = (1 - alpha) * (self.var + diff * increment)
+        self.count += 1
+
+
+class AnomalyDetector:
+    """Flags spend spikes per series (org total, intraday, optionally per project) as buckets arrive.
+
+    Each series keeps only an EWMA mean/variance and the key of the last bucket it
+    saw, so buckets are scored once, in order, in O(1) time and memory. A value is
+    an anomaly when its z-score exceeds `z_threshold` and it is at least `min_delta`
+    dollars above the mean. Anomalous values are clipped before updating the
+    statistics so a spike does not mask the next one, and the standard deviation is
+    floored at `rel_floor` of the mean so near-constant series are not over-sensitive.
+    """
+
+    def __init__(self, alpha=0.1, z_threshold=4.0, min_samples=7, min_delta=1.0, rel_floor=0.1,
+                 per_project=False, history=100):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.min_delta = min_delta
+        self.rel_floor = rel_floor
+        self.per_project = per_project
+        self.series = {}
+        self.recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            alpha=float(os.getenv("ANOMALY_ALPHA", 0.1)),
+            z_threshold=float(os.getenv("ANOMALY_Z", 4.0)),
+            min_samples=int(os.getenv("ANOMALY_MIN_SAMPLES", 7)),
+            min_delta=float(os.getenv("ANOMALY_MIN_DELTA", 1.0)),
+            per_project=os.getenv("ANOMALY_PER_PROJECT", "false").lower() == "true",
+        )
+
+    def last_key(self, series):
+        state = self.series.get(series)
+        return state.last_key if state is not None else None
+
+    def observe(self, series, key, value, now=None):
+        # Returns an anomaly dict, or None. Keys must increase; a bucket already seen is ignored.
+        with self._lock:
+            state = self.series.get(series)
+            if state is None:
+                state = self.series[series] = EwmaSeries()
+            if state.last_key is not None and key <= state.last_key:
+                return None
+            anomaly = None
+            update = value
+            if state.count >= self.min_samples:
+                std = max(math.sqrt(state.var), self.rel_floor * abs(state.mean), 1e-9)
+                z = (value - state.mean) / std
+                if z > self.z_threshold and value - state.mean >= self.min_delta:
+                    anomaly = {
+                        "series": series,
+                        "key": key,
+                        "value": round(value, 4),
+                        "expected": round(state.mean, 4),
+                        "z": round(z, 2),
+                        "detected_at": int(now if now is not None else time.time()),
+                    }
+                    self.recent.append(anomaly)
+                update = min(value, state.mean + self.z_threshold * std)
+            state.update(update, self.alpha)
+            state.last_key = key
+            return anomaly
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: {"mean": round(s.mean, 4), "std": round(math.sqrt(s.var), 4), "samples": s.count}
+                for name, s in self.series.items()
+            }
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+from http_client import AsyncApiClient, UpstreamError
+from monitor import OpenAIMonitor, logger
+from metrics import stage
+from usage import USAGE_ENDPOINTS
+
+
+class AsyncOpenAIMonitor(OpenAIMonitor):
+    """asyncio variant of OpenAIMonitor for the FastAPI server.
+
+    Upstream I/O goes through httpx and alerts are handed to the dispatcher
+    thread, so slow upstreams never tie up the event loop. Ledger, bucket-store and
+    snapshot-file access runs in worker threads: it fsyncs, and with several workers
+    the ledger flock can wait on another process, which must not stall every route.
+    """
+
+    def __init__(self, ledger_file="ledger.json", store_file=None, client=None, **kwargs):
+        super().__init__(ledger_file=ledger_file, store_file=store_file,
+                         client=client or AsyncApiClient.from_env(), **kwargs)
+        # Created lazily so it binds to the running loop (Python 3.9 binds at construction)
+        self._async_refresh_lock = None
+        self._warm_up_task = None
+
+    async def _fetch_window(self, window_start, window_end):
+        rows = []
+        query_start = window_start
+        try:
+            while query_start is not None and query_start < window_end:
+                data = await self.client.get_json("organization/costs", self.api_key, params=self._costs_params(query_start, window_end))
+                page_rows, query_start = self._parse_page(data, query_start)
+                rows.extend(page_rows)
+                self._pages_fetched += 1
+        except UpstreamError as e:
+            logger.error(f"Failed to fetch costs: {e}")
+            return None
+        return rows
+
+    async def backfill(self, start_time, end_time=None):
+        if end_time is None:
+            end_time = int(self.clock()) // 86400 * 86400 + 86400
+        windows = self._backfill_windows(start_time, end_time)
+        if len(windows) > 1:
+            logger.info(f"Backfilling {len(windows)} windows with {self.backfill_workers} workers")
+        self._start_progress(len(windows))
+        semaphore = asyncio.Semaphore(self.backfill_workers)
+
+        async def fetch(window):
+            async with semaphore:
+                rows = await self._fetch_window(*window)
+            self._window_done(rows)
+            return rows
+
+        results = await asyncio.gather(*(fetch(w) for w in windows))
+        with stage(self.name, "merge"):
+            return await asyncio.to_thread(self._merge_windows, windows, results)
+
+    async def get_aggregated_costs(self):
+        if not self.api_key:
+            logger.warning(f"[{self.name}] No admin API key configured. Cannot fetch costs.")
+            self._fetch_error = "No admin API key configured"
+            return {"total": 0.0, "daily": 0.0, "monthly": 0.0, "history": []}
+
+        started, pages = time.perf_counter(), self._pages_fetched
+        with stage(self.name, "plan"):
+            ledger, query_start = await asyncio.to_thread(self._plan_fetch)
+        with stage(self.name, "backfill"):
+            changed = await self.backfill(query_start)
+        self._record_fetch()
+        with stage(self.name, "aggregate"):
+            costs = await asyncio.to_thread(self._aggregate, ledger, changed)
+        self._observe_fetch(started, pages)
+        return costs
+
+    async def refresh(self):
+        if self.follower:
+            if self._follow_due():
+                await asyncio.to_thread(self._follow)
+            return self._followed_status()
+        if self._async_refresh_lock is None:
+            self._async_refresh_lock = asyncio.Lock()
+        generation = self._fetch_generation
+        async with self._async_refresh_lock:
+            if self._fetch_generation != generation and self._snapshot is not None:
+                return dict(self._snapshot)
+            costs = await self.get_aggregated_costs()
+            self._fetch_generation += 1
+            self.warming = False
+            with stage(self.name, "publish"):
+                return await asyncio.to_thread(self._publish, costs)
+
+    async def warm_up(self):
+        # Catch-up fetch run in the background at startup; get_status serves the restored
+        # snapshot (flagged warming) until it completes
+        self.progress.update(state="warming", started_at=time.time(), finished_at=None, error=None)
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"[{self.name}] Warm-up failed: {e}")
+            self.progress.update(state="failed", error=str(e))
+        else:
+            self.progress["state"] = "ready"
+        finally:
+            self.progress["finished_at"] = time.time()
+
+    def start_warm_up(self):
+        if self._warm_up_task is None or self._warm_up_task.done():
+            self._warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
+        return self._warm_up_task
+
+    async def get_status(self, max_age=None):
+        if max_age is None:
+            max_age = self._max_age()
+        snapshot = self._snapshot
+        if self.follower:
+            snapshot = await self.refresh()
+        elif self.warming and snapshot is not None:
+            # Never block on the catch-up crawl: answer from the restored snapshot
+            self.start_warm_up()
+        elif snapshot is None or self.clock() - snapshot.get("refreshed_at", snapshot["as_of"]) > max_age:
+            snapshot = await self.refresh()
+        status = dict(snapshot)
+        status["stale"] = self.clock() - status["as_of"] > max_age
+        return status
+
+    async def get_balance(self):
+        return await self.refresh()
+
+    async def sync_balance(self, actual_balance: float):
+        await self.refresh()
+        return await asyncio.to_thread(self._apply_sync, actual_balance)
+
+    async def add_deposit(self, amount: float):
+        return await asyncio.to_thread(super().add_deposit, amount)
+
+    async def refresh_intraday(self):
+        if not self.api_key:
+            return
+        self._intraday_failed = False
+
+        async def fetch(endpoint):
+            start, page = self._usage_start(endpoint), None
+            while True:
+                try:
+                    data = await self.client.get_json(f"organization/usage/{endpoint}", self.api_key,
+                                                      params=self._usage_params(start, page))
+                except UpstreamError as e:
+                    logger.error(f"[{self.name}] Failed to fetch {endpoint} usage: {e}")
+                    self._intraday_failed = True
+                    return
+                page = self._ingest_usage_page(endpoint, data)
+                if not page:
+                    return
+
+        with stage(self.name, "intraday"):
+            await asyncio.gather(*(fetch(endpoint) for endpoint in USAGE_ENDPOINTS))
+            self.burn_window.prune(int(self.clock()))
+            await asyncio.to_thread(self._observe_intraday)
+
+    async def check_and_alert(self):
+        if self.follower:
+            return await self.refresh()
+        try:
+            await self.refresh_intraday()
+            status = await self.get_balance()
+        except Exception:
+            self.poller.record_failure(self.clock())
+            raise
+        self._schedule_next(status)
+        await asyncio.to_thread(self._raise_alerts, status)
+        return status
+
+    async def check_if_due(self):
+        if not self.poller.due(self.clock()):
+            return None
+        return await self.check_and_alert()
+
+    async def close(self):
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        await self.client.close()
+        self.store.close()
+        self.ledger.close()
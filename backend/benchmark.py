@@ -0,0 +1,350 @@
+"""Offline benchmarks against local stand-ins for the OpenAI API, SMTP and webhooks.
+
+    python benchmark.py                       # every scenario, default settings
+    python benchmark.py cold steady --years 3 --latency 0.05 --throttle-every 20
+    python benchmark.py pollers --pollers 100 --duration 10 --json results.json
+
+Scenarios share one scratch directory, so `steady`, `pollers` and `alert` run
+against the store and ledger that `cold` produced. Nothing touches the network
+or the ledger.json in this directory.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import logging
+from collections import Counter
+
+from fake_services import FakeOpenAI, SMTPSink, WebhookSink
+
+SCENARIOS = ("cold", "steady", "pollers", "alert")
+
+
+def percentile(samples, pct):
+    # Nearest-rank percentile of a list of seconds, returned in milliseconds
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return round(ordered[min(rank, len(ordered) - 1)] * 1000, 2)
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples, 50),
+        "p99_ms": percentile(samples, 99),
+        "max_ms": round(max(samples) * 1000, 2) if samples else None,
+    }
+
+
+class LedgerIO:
+    """Counts ledger reads, journal appends and compactions by wrapping the Ledger class."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.seconds = Counter()
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def install(self, ledger_cls):
+        io = self
+
+        def wrap(name, measure_bytes):
+            original = getattr(ledger_cls, name)
+
+            def wrapper(ledger, *args, **kwargs):
+                before = io._size(ledger.journal_path)
+                started = time.perf_counter()
+                result = original(ledger, *args, **kwargs)
+                elapsed = time.perf_counter() - started
+                with io._lock:
+                    io.counts[name] += 1
+                    io.seconds[name] += elapsed
+                    if measure_bytes:
+                        after = io._size(ledger.journal_path)
+                        # A compaction truncates the journal, so count only what is left of it
+                        io.bytes_written += after - before if after >= before else after
+                        if name == "compact":
+                            io.bytes_written += io._size(ledger.path)
+                return result
+            setattr(ledger_cls, name, wrapper)
+
+        wrap("snapshot", False)
+        wrap("record", True)
+        wrap("compact", True)
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def take(self):
+        with self._lock:
+            result = {
+                "reads": self.counts["snapshot"],
+                "appends": self.counts["record"],
+                "compactions": self.counts["compact"],
+                "bytes_written": self.bytes_written,
+                "write_ms": round((self.seconds["record"] + self.seconds["compact"]) * 1000, 2),
+            }
+            self.counts.clear()
+            self.seconds.clear()
+            self.bytes_written = 0
+        return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_ledger(path, years):
+    # Tracking starts `years` back so the first refresh has to backfill all of it
+    with open(path, "w") as f:
+        json.dump({
+            "total_deposited": 100000.0,
+            "start_date": int(time.time()) // 86400 * 86400 - int(years * 365) * 86400,
+            "historical_spend": 0.0,
+            "monthly_history": {},
+            "last_alert_sent": 0,
+        }, f)
+
+
+class Bench:
+    def __init__(self, args, fake, sink, webhook, io):
+        self.args = args
+        self.fake = fake
+        self.sink = sink
+        self.webhook = webhook
+        self.io = io
+        self.results = {}
+
+    def _upstream(self):
+        return {"requests": sum(self.fake.requests.values()), "throttled": self.fake.throttled,
+                "by_path": dict(self.fake.requests)}
+
+    def _start(self):
+        self.fake.reset_counters()
+        self.io.take()
+
+    def _finish(self, name, result):
+        result["upstream"] = self._upstream()
+        result["ledger_io"] = self.io.take()
+        self.results[name] = result
+        print(f"{name:8s} {json.dumps(result)}")
+
+    def _monitor(self):
+        from monitor import OpenAIMonitor
+        return OpenAIMonitor(ledger_file="ledger.json")
+
+    @staticmethod
+    def _close(monitor):
+        monitor.client.close()
+        monitor.store.close()
+        monitor.ledger.close()
+        monitor.dispatcher.close()
+
+    def cold(self):
+        # Same set simulate.py clears: a leftover history or snapshot would make the run warm
+        for path in ("ledger.json", "ledger.json.journal", "ledger.json.history", "ledger.snapshot.json",
+                     "costs.db", "costs.db-wal", "costs.db-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        write_ledger("ledger.json", self.args.years)
+        self._start()
+        started = time.perf_counter()
+        monitor = self._monitor()
+        status = monitor.refresh()
+        elapsed = time.perf_counter() - started
+        days = len(monitor.store.daily_series())
+        self._close(monitor)
+        self._finish("cold", {"seconds": round(elapsed, 3), "days_stored": days,
+                              "total_spend": status["total_spend"]})
+
+    def steady(self):
+        monitor = self._monitor()
+        monitor.refresh()
+        self._start()
+        samples = []
+        for _ in range(self.args.refreshes):
+            started = time.perf_counter()
+            monitor.refresh()
+            samples.append(time.perf_counter() - started)
+        result = {"latency": latency_summary(samples)}
+        result["requests_per_refresh"] = round(sum(self.fake.requests.values()) / max(len(samples), 1), 2)
+        self._close(monitor)
+        self._finish("steady", result)
+
+    def pollers(self):
+        import requests
+        import uvicorn
+        import main
+
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        # The registry is built after boot; wait until the API serves it
+        while requests.get(f"http://127.0.0.1:{port}/api/health").json()["status"] == "starting":
+            time.sleep(0.05)
+
+        url = f"http://127.0.0.1:{port}/api/status"
+        self._start()
+        samples, errors = [], Counter()
+        lock = threading.Lock()
+        deadline = time.perf_counter() + self.args.duration
+
+        def poll():
+            session = requests.Session()
+            etag = None
+            while time.perf_counter() < deadline:
+                headers = {"If-None-Match": etag} if etag and self.args.conditional else {}
+                started = time.perf_counter()
+                try:
+                    response = session.get(url, headers=headers, timeout=30)
+                    elapsed = time.perf_counter() - started
+                    etag = response.headers.get("ETag", etag)
+                    code = response.status_code
+                except requests.RequestException as e:
+                    elapsed, code = time.perf_counter() - started, type(e).__name__
+                with lock:
+                    samples.append(elapsed)
+                    errors[code] += 1
+                if self.args.interval:
+                    time.sleep(self.args.interval)
+            session.close()
+
+        workers = [threading.Thread(target=poll) for _ in range(self.args.pollers)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        server.should_exit = True
+        thread.join()
+        self._finish("pollers", {
+            "pollers": self.args.pollers,
+            "latency": latency_summary(samples),
+            "requests_per_second": round(len(samples) / elapsed, 1),
+            "responses": {str(code): count for code, count in errors.items()},
+        })
+
+    def alert(self):
+        monitor = self._monitor()
+        monitor.refresh()
+        self._start()
+        emails, posts = len(self.sink.messages), len(self.webhook.requests)
+        samples = []
+        for _ in range(self.args.alerts):
+            started = time.perf_counter()
+            monitor.queue_alert(monitor.threshold - 1)
+            samples.append(time.perf_counter() - started)
+            monitor._mark_alert_sent(monitor._load_ledger())
+        # Wait for the dispatcher to finish every (alert, channel) delivery
+        expected = self.args.alerts * len(monitor.dispatcher.channels)
+        while len(monitor.dispatcher.results) < expected:
+            time.sleep(0.01)
+        results = list(monitor.dispatcher.results)
+        self._close(monitor)
+        self._finish("alert", {
+            "enqueue": latency_summary(samples),
+            "delivery": latency_summary([r["finished_at"] - r["queued_at"] for r in results]),
+            "failed": sum(1 for r in results if not r["ok"]),
+            "emails": len(self.sink.messages) - emails,
+            "webhooks": len(self.webhook.requests) - posts,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline monitor benchmarks")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--years", type=float, default=3, help="history length for the cold backfill")
+    parser.add_argument("--page-size", type=int, default=100, help="largest page the fake API returns")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every upstream response")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth upstream request with 429")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--projects", type=int, default=3)
+    parser.add_argument("--line-items", type=int, default=4)
+    parser.add_argument("--refreshes", type=int, default=50, help="refreshes timed in the steady scenario")
+    parser.add_argument("--pollers", type=int, default=100, help="concurrent /api/status clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds the pollers run")
+    parser.add_argument("--interval", type=float, default=0.0, help="pause between one poller's requests")
+    parser.add_argument("--conditional", action="store_true", help="pollers send If-None-Match")
+    parser.add_argument("--alerts", type=int, default=10, help="alert emails timed in the alert scenario")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="client-side upstream requests/second")
+    parser.add_argument("--workdir", help="scratch directory (default: a new temporary one)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    fake = FakeOpenAI(
+        history_days=int(args.years * 365) + 30, page_size=args.page_size, latency=args.latency,
+        throttle_every=args.throttle_every, retry_after=args.retry_after,
+        projects=args.projects, line_items=args.line_items,
+    ).start()
+    sink = SMTPSink().start()
+    webhook = WebhookSink().start()
+
+    # Configure before the monitor modules read their environment
+    os.environ.update({
+        "OPENAI_API_BASE": fake.base_url,
+        "OPENAI_ADMIN_KEY": "sk-admin-benchmark",
+        "OPENAI_RATE_LIMIT": str(args.rate_limit),
+        "OPENAI_RATE_BURST": str(max(int(args.rate_limit), 1)),
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_STARTTLS": "false",
+        "ALERT_WEBHOOK_URLS": webhook.url,
+        "SMTP_EMAIL": "monitor@localhost",
+        "SMTP_PASSWORD": "benchmark",
+        "ALERT_RECIPIENT_EMAIL": "ops@localhost",
+        "INITIAL_TOTAL_DEPOSITED": "100000",
+    })
+    for name in ("ORGS_CONFIG", "COST_STORE_FILE", "PRICE_TABLE_FILE"):
+        os.environ.pop(name, None)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="monitor-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import ledger
+    io = LedgerIO()
+    io.install(ledger.Ledger)
+    import monitor  # noqa: F401  (configures logging on import)
+    logging.getLogger("OpenAIMonitor").setLevel(logging.WARNING)
+
+    bench = Bench(args, fake, sink, webhook, io)
+    selected = [name for name in SCENARIOS if name in (args.scenarios or SCENARIOS)]
+    if "cold" not in selected and not os.path.exists("costs.db"):
+        selected.insert(0, "cold")
+    print(f"workdir  {workdir}")
+    for name in selected:
+        getattr(bench, name)()
+
+    fake.stop()
+    sink.stop()
+    webhook.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(bench.results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import bisect
+import threading
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+GROUP_KEYS = ("project_id", "line_item")
+EPOCH = datetime(1970, 1, 1)
+
+
+def day_number(value):
+    # Epoch day for a 'YYYY-MM-DD' string or a unix timestamp
+    if isinstance(value, str):
+        return (datetime.strptime(value, '%Y-%m-%d') - EPOCH).days
+    return int(value) // 86400
+
+
+class _Dictionary:
+    # Interns strings to small integer codes for the columnar arrays
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CostColumns:
+    """Per-project / per-line-item daily costs held as parallel typed arrays.
+
+    Rows are kept sorted by day, so a date range is two bisects and queries only
+    touch the rows inside it. Project and line item strings are dictionary-encoded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.days = array('l')
+        self.projects = array('l')
+        self.line_items = array('l')
+        self.cents = array('d')
+        self.project_dict = _Dictionary()
+        self.line_item_dict = _Dictionary()
+
+    def __len__(self):
+        return len(self.days)
+
+    def _encode(self, rows):
+        days, projects, line_items, cents = array('l'), array('l'), array('l'), array('d')
+        for start_t, project_id, line_item, value in rows:
+            days.append(day_number(start_t))
+            projects.append(self.project_dict.encode(project_id))
+            line_items.append(self.line_item_dict.encode(line_item))
+            cents.append(value)
+        return days, projects, line_items, cents
+
+    def load(self, rows):
+        # rows: (start_time, project_id, line_item, cents) in time order, e.g. CostStore.iter_line_items()
+        with self._lock:
+            self.days, self.projects, self.line_items, self.cents = self._encode(rows)
+
+    def replace_days(self, first_start, last_start, rows):
+        # Swaps every row for the days in [first_start, last_start] for the freshly fetched ones
+        rows = sorted(rows, key=lambda row: row[0])
+        with self._lock:
+            days, projects, line_items, cents = self._encode(rows)
+            lo = bisect.bisect_left(self.days, day_number(first_start))
+            hi = bisect.bisect_right(self.days, day_number(last_start))
+            self.days[lo:hi] = days
+            self.projects[lo:hi] = projects
+            self.line_items[lo:hi] = line_items
+            self.cents[lo:hi] = cents
+
+    def query(self, first_day, last_day, group_by=GROUP_KEYS, top=None):
+        # Sums cents per group over an inclusive day range; returns rows sorted by spend
+        columns = []
+        for key in group_by:
+            if key not in GROUP_KEYS:
+                raise ValueError(f"Unknown group_by key '{key}'")
+            columns.append(key)
+
+        with self._lock:
+            lo = bisect.bisect_left(self.days, day_number(first_day))
+            hi = bisect.bisect_right(self.days, day_number(last_day))
+            # Each row's group is one combined code (project * line items + line item), so the
+            # sums are a single bincount over the range. The arrays are read in place through
+            # buffer views, which must not outlive the lock (they block resizing).
+            sizes = [len(self.project_dict.values) if key == "project_id" else len(self.line_item_dict.values)
+                     for key in columns]
+            codes = np.zeros(hi - lo, dtype=np.int64)
+            for key, size in zip(columns, sizes):
+                source = self.projects if key == "project_id" else self.line_items
+                codes = codes * size + np.frombuffer(source, dtype=np.dtype(source.typecode))[lo:hi]
+            cents = np.frombuffer(self.cents, dtype=np.float64)[lo:hi]
+            width = int(np.prod(sizes)) if sizes else 1
+            totals = np.bincount(codes, weights=cents, minlength=width)
+            present = np.bincount(codes, minlength=width) > 0
+            del cents
+            project_values = list(self.project_dict.values)
+            line_item_values = list(self.line_item_dict.values)
+
+        groups = np.flatnonzero(present)
+        # Largest first; a stable sort keeps ties in code order
+        groups = groups[np.argsort(-totals[groups], kind="stable")]
+        grand_total = float(totals[groups].sum())
+        other = 0.0
+        if top is not None and len(groups) > top:
+            other = float(totals[groups[top:]].sum())
+            groups = groups[:top]
+
+        ranked = []
+        for code, value in zip(groups.tolist(), totals[groups].tolist()):
+            key_codes = []
+            for size in reversed(sizes):
+                code, part = divmod(code, size)
+                key_codes.append(part)
+            ranked.append((key_codes[::-1], value))
+
+        rows = []
+        for group, value in ranked:
+            row = {}
+            for key, code in zip(columns, group):
+                row[key] = project_values[code] if key == "project_id" else line_item_values[code]
+            row["amount"] = round(value / 100, 4)
+            row["share"] = round(value / grand_total, 4) if grand_total else 0.0
+            rows.append(row)
+        return {
+            "rows": rows,
+            "other": round(other / 100, 4),
+            "total": round(grand_total / 100, 4),
+            "row_count": hi - lo,
+        }
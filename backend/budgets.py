@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("OpenAIMonitor")
+
+PERIODS = ("day", "month")
+METRICS = ("spend", "share")
+# Every engine tracks the unfiltered total; 'share' rules divide by it
+TOTAL = (None, None)
+
+
+def parse_quiet_hours(value):
+    # "21-6" -> (21, 6); empty or "off" disables quiet hours
+    if value is None or isinstance(value, (list, tuple)):
+        return tuple(value) if value else None
+    value = value.strip()
+    if not value or value == "off":
+        return None
+    start, end = value.split("-")
+    return int(start), int(end)
+
+
+def alert_allowed(last_sent, now, throttle_seconds, quiet_hours):
+    # Shared by the balance alert and every budget rule
+    if now - last_sent <= throttle_seconds:
+        return False
+    if quiet_hours:
+        start, end = quiet_hours
+        hour = datetime.fromtimestamp(now).hour
+        quiet = start <= hour or hour < end if start > end else start <= hour < end
+        if quiet:
+            return False
+    return True
+
+
+def _period_key(day, period):
+    # Epoch day number -> 'YYYY-MM-DD' or 'YYYY-MM'; both sort chronologically
+    return datetime.utcfromtimestamp(day * 86400).strftime('%Y-%m-%d' if period == "day" else '%Y-%m')
+
+
+class BudgetRule:
+    def __init__(self, config, defaults):
+        self.name = config["name"]
+        self.period = config.get("period", "month")
+        self.metric = config.get("metric", "spend")
+        if self.period not in PERIODS:
+            raise ValueError(f"Rule '{self.name}': period must be one of {PERIODS}")
+        if self.metric not in METRICS:
+            raise ValueError(f"Rule '{self.name}': metric must be one of {METRICS}")
+        self.limit = float(config["above"])
+        self.filter = (config.get("project_id"), config.get("line_item"))
+        if self.metric == "share" and self.filter == TOTAL:
+            raise ValueError(f"Rule '{self.name}': a share rule needs a project_id or line_item")
+        self.org = config.get("org")
+        self.recipients = config.get("recipients")
+        self.throttle_seconds = float(config.get("throttle_seconds", defaults["throttle_seconds"]))
+        self.quiet_hours = parse_quiet_hours(config.get("quiet_hours", defaults["quiet_hours"]))
+
+    def describe(self):
+        scope = " / ".join(part for part in self.filter if part) or "all spend"
+        if self.metric == "share":
+            return f"{scope} share of {self.period}ly spend above {self.limit:.0%}"
+        return f"{scope} per {self.period} above ${self.limit:.2f}"
+
+
+class BudgetEngine:
+    """Evaluates spend rules against running per-period totals.
+
+    Totals are kept per distinct (project_id, line_item) filter rather than per
+    rule, and are adjusted by the difference whenever a day's buckets are
+    (re)fetched, so a refresh costs O(new line items) no matter how many rules
+    there are or how much history is stored. Only days from the start of the
+    previous month onward are retained.
+    """
+
+    def __init__(self, rules=()):
+        self._lock = threading.Lock()
+        self.rules = list(rules)
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate budget rule names")
+        self.filters = {rule.filter for rule in self.rules} | {TOTAL}
+        # epoch day -> {filter: amount}, and (filter, period, period key) -> running total
+        self._days = {}
+        self._totals = {}
+
+    @classmethod
+    def from_env(cls, org="default"):
+        # BUDGET_RULES_FILE: {"throttle_seconds": 7200, "quiet_hours": "21-6", "rules": [...]}
+        path = os.getenv("BUDGET_RULES_FILE")
+        if not path:
+            return cls()
+        with open(path, "r") as f:
+            data = json.load(f)
+        defaults = {
+            "throttle_seconds": data.get("throttle_seconds", os.getenv("ALERT_THROTTLE_SECONDS", 7200)),
+            "quiet_hours": data.get("quiet_hours", os.getenv("ALERT_QUIET_HOURS", "21-6")),
+        }
+        rules = [BudgetRule(config, defaults) for config in data.get("rules", [])]
+        return cls(rule for rule in rules if rule.org in (None, org))
+
+    def window_start(self, now=None):
+        # First epoch day kept: the 1st of the previous month
+        today = datetime.utcfromtimestamp(now if now is not None else time.time())
+        year, month = (today.year, today.month - 1) if today.month > 1 else (today.year - 1, 12)
+        return (datetime(year, month, 1) - datetime(1970, 1, 1)).days
+
+    def _day_amounts(self, items):
+        # A line item can match at most four filters, so this is O(items) for any rule count
+        amounts = {}
+        for project_id, line_item, value in items:
+            for key in ((project_id, line_item), (project_id, None), (None, line_item), TOTAL):
+                if key in self.filters:
+                    amounts[key] = amounts.get(key, 0.0) + value
+        return amounts
+
+    def _replace_day(self, day, amounts):
+        old = self._days.get(day, {})
+        for key in set(old) | set(amounts):
+            delta = amounts.get(key, 0.0) - old.get(key, 0.0)
+            if delta:
+                for period in PERIODS:
+                    slot = (key, period, _period_key(day, period))
+                    self._totals[slot] = self._totals.get(slot, 0.0) + delta
+        self._days[day] = amounts
+
+    def _prune(self, now):
+        first = self.window_start(now)
+        for day in [d for d in self._days if d < first]:
+            for key, value in self._days.pop(day).items():
+                for period in PERIODS:
+                    slot = (key, period, _period_key(day, period))
+                    self._totals[slot] = self._totals.get(slot, 0.0) - value
+        oldest = {period: _period_key(first, period) for period in PERIODS}
+        for slot in [s for s in self._totals if s[2] < oldest[s[1]]]:
+            del self._totals[slot]
+
+    def load(self, rows, now=None):
+        # rows: (start_time, project_id, line_item, cents) in time order, e.g.
+        # CostStore.iter_line_items(since=window_start * 86400)
+        if not self.rules:
+            return
+        by_day = {}
+        for start_t, project_id, line_item, cents in rows:
+            by_day.setdefault(start_t // 86400, []).append((project_id, line_item, cents / 100))
+        with self._lock:
+            self._days, self._totals = {}, {}
+            for day, items in by_day.items():
+                self._replace_day(day, self._day_amounts(items))
+            self._prune(now if now is not None else time.time())
+
+    def update_days(self, rows, now=None):
+        # rows: freshly fetched (start_time, end_time, amount, items) buckets; each replaces its day
+        if not self.rules:
+            return
+        first = self.window_start(now)
+        with self._lock:
+            for start_t, _, _, items in rows:
+                if start_t // 86400 >= first:
+                    self._replace_day(start_t // 86400, self._day_amounts(items))
+            self._prune(now if now is not None else time.time())
+
+    def _value(self, rule, period):
+        spend = self._totals.get((rule.filter, rule.period, period), 0.0)
+        value = spend
+        if rule.metric == "share":
+            total = self._totals.get((TOTAL, rule.period, period), 0.0)
+            value = spend / total if total > 0 else 0.0
+        return {"rule": rule, "period": period, "value": value, "spend": spend, "breached": value > rule.limit}
+
+    def values(self, now=None):
+        # Current-period value of every rule
+        today = int(now if now is not None else time.time()) // 86400
+        with self._lock:
+            return [self._value(rule, _period_key(today, rule.period)) for rule in self.rules]
+
+    def evaluate(self, now=None, settle_days=0):
+        # Rules over their limit, in the current period or in one that ended within the last
+        # settle_days (its buckets may still be arriving); O(rules), independent of history
+        today = int(now if now is not None else time.time()) // 86400
+        breaches = []
+        with self._lock:
+            for rule in self.rules:
+                current = _period_key(today, rule.period)
+                periods = sorted({_period_key(day, rule.period) for day in range(today - settle_days, today + 1)})
+                for period in periods:
+                    result = self._value(rule, period)
+                    if result["breached"]:
+                        result["current"] = period == current
+                        breaches.append(result)
+        return breaches
@@ -0,0 +1,80 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+
+logger = logging.getLogger("OpenAIMonitor")
+
+
+class SnapshotPending(Exception):
+    """Raised by a follower asked for a status before the leader has published one."""
+
+
+class LeaderLease:
+    """Time-limited leadership lease stored in a SQLite file shared by all workers.
+
+    The holder renews it well inside `ttl`; if it stops renewing (crash, hang) the
+    lease expires and the next worker to try takes over. Acquire and renew are the
+    same compare-and-set, run in an IMMEDIATE transaction so two workers can never
+    both win.
+    """
+
+    def __init__(self, path, name="poller", ttl=15.0, holder=None):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    @classmethod
+    def from_env(cls):
+        # Coordination is opt-in: without LEADER_LEASE_FILE every process acts as the leader
+        path = os.getenv("LEADER_LEASE_FILE")
+        if not path:
+            return None
+        return cls(path, ttl=float(os.getenv("LEADER_LEASE_TTL", 15)))
+
+    def try_acquire(self):
+        # Takes or renews the lease; True while this process holds it
+        now = time.time()
+        cur = self._conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            row = cur.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is None or row[0] == self.holder or row[1] < now:
+                cur.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.ttl),
+                )
+                if row is not None and row[0] != self.holder:
+                    logger.info(f"Took over expired lease '{self.name}' from {row[0]}")
+                acquired = True
+            else:
+                acquired = False
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def holder_of(self):
+        row = self._conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def release(self):
+        self._conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,87 @@
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger("OpenAIMonitor")
+
+# Scalar snapshot fields pushed to dashboards when they change
+DELTA_FIELDS = ("balance", "total_deposited", "total_spend", "daily_usage", "monthly_usage", "threshold",
+                "projected_balance", "burn_rate_per_hour", "intraday_estimate", "warming")
+
+
+def diff_status(previous, current, previous_history, current_history):
+    changes = {k: current[k] for k in DELTA_FIELDS if previous.get(k) != current.get(k)}
+    old_months = {row["key"]: row["amount"] for row in previous_history}
+    history_updates = [row for row in current_history if old_months.get(row["key"]) != row["amount"]]
+    if history_updates:
+        changes["history_updates"] = history_updates
+    new_months = {row["key"] for row in current_history}
+    history_removed = [key for key in old_months if key not in new_months]
+    if history_removed:
+        changes["history_removed"] = history_removed
+    return changes
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StatusBroadcaster:
+    """Fans snapshot changes out to Server-Sent Events subscribers.
+
+    Registered as a monitor listener; a refresh that leaves every pushed field
+    unchanged produces no event at all.
+    """
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._last = {}
+        self._subscribers = set()
+        self._loop = None
+
+    def attach(self, monitor):
+        monitor.listeners.append(self.on_publish)
+        if monitor._snapshot is not None:
+            self._last[monitor.name] = (dict(monitor._snapshot), monitor.get_history()["items"])
+
+    def on_publish(self, monitor, status):
+        previous = self._last.get(monitor.name)
+        history = monitor.get_history()["items"]
+        self._last[monitor.name] = (status, history)
+        # The first snapshot is only recorded: subscribers receive it from stream() itself
+        if previous is None or self._loop is None:
+            return
+        changes = diff_status(previous[0], status, previous[1], history)
+        if not changes:
+            return
+        event = ("delta", {"revision": status["revision"], "as_of": status["as_of"], "changes": changes})
+        # Snapshots may be published from worker threads; hand delivery to the event loop
+        self._loop.call_soon_threadsafe(self._deliver, monitor.name, event)
+
+    def _deliver(self, org, event):
+        for subscriber_org, queue in list(self._subscribers):
+            if subscriber_org != org:
+                continue
+            if queue.full():
+                # Slow client: drop its oldest event rather than block the publisher
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def stream(self, monitor, is_disconnected, keepalive=15.0):
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscriber = (monitor.name, queue)
+        self._subscribers.add(subscriber)
+        try:
+            # Every (re)connect starts from a full snapshot, then receives deltas only
+            status = await monitor.get_status()
+            yield format_sse("snapshot", status)
+            while not await is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            self._subscribers.discard(subscriber)
@@ -0,0 +1,32 @@
+import io
+import csv
+import json
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def export_columns(group_by):
+    return ["day", *group_by, "amount"]
+
+
+def encode_rows(rows, columns, fmt, chunk_rows=500):
+    # Encodes row tuples into text chunks of up to `chunk_rows` rows, so a response streams
+    # in reasonably sized writes without ever holding more than one chunk
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    count = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row))))
+            buffer.write("\n")
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,252 @@
+"""Local stand-ins for the OpenAI admin API, an SMTP server and a webhook receiver.
+
+Used by benchmark.py so every scenario runs without network access or real
+credentials. All servers run on daemon threads bound to 127.0.0.1.
+"""
+import json
+import time
+import random
+import threading
+import socketserver
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+DAY = 86400
+
+
+class FakeOpenAI:
+    """Serves /v1/organization/costs and /v1/organization/usage/* from synthetic data.
+
+    history_days  days of cost buckets ending today
+    page_size     most buckets returned per page, whatever `limit` asks for
+    latency       seconds added to every response
+    throttle_every  every Nth request gets a 429 with Retry-After (0 disables)
+    """
+
+    def __init__(self, history_days=365, page_size=100, latency=0.0, throttle_every=0, retry_after=0,
+                 projects=3, line_items=4, daily_amount=10.0, seed=0):
+        self.history_days = history_days
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.projects = [f"proj_{i}" for i in range(projects)]
+        self.line_items = [f"gpt-4o-{i}" for i in range(line_items)]
+        self.daily_amount = daily_amount
+        self.requests = Counter()
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._amounts = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def amount_for(self, day_start):
+        # Deterministic per-day spend so repeated fetches agree
+        with self._lock:
+            if day_start not in self._amounts:
+                self._amounts[day_start] = round(self.daily_amount * self._rng.uniform(0.5, 1.5), 6)
+            return self._amounts[day_start]
+
+    def _costs(self, query):
+        today = int(time.time()) // DAY * DAY
+        first = today - (self.history_days - 1) * DAY
+        start = int(query["start_time"][0])
+        end = int(query.get("end_time", [today + DAY])[0])
+        limit = min(int(query.get("limit", [7])[0]), self.page_size)
+        cursor = max(first, -(-start // DAY) * DAY)
+        grouped = "group_by" in query or "group_by[]" in query
+
+        data = []
+        while cursor < min(end, today + DAY) and len(data) < limit:
+            total = self.amount_for(cursor)
+            if grouped:
+                share = total / (len(self.projects) * len(self.line_items))
+                results = [
+                    {"object": "organization.costs.result", "amount": {"value": share, "currency": "usd"},
+                     "project_id": project, "line_item": line_item}
+                    for project in self.projects for line_item in self.line_items
+                ]
+            else:
+                results = [{"object": "organization.costs.result", "amount": {"value": total, "currency": "usd"}}]
+            data.append({"object": "bucket", "start_time": cursor, "end_time": cursor + DAY, "results": results})
+            cursor += DAY
+        return {"object": "page", "data": data, "has_more": cursor < min(end, today + DAY), "next_page": None}
+
+    def _usage(self, path, query):
+        now = int(time.time())
+        start = int(query["start_time"][0]) // 3600 * 3600
+        data = []
+        for bucket_start in range(start, now + 1, 3600):
+            results = []
+            if path.endswith("/completions"):
+                results.append({"object": "organization.usage.completions.result", "model": "gpt-4o-2024-08-06",
+                                "input_tokens": 200000, "input_cached_tokens": 50000, "output_tokens": 20000})
+            data.append({"object": "bucket", "start_time": bucket_start, "end_time": bucket_start + 3600,
+                         "results": results})
+        return {"object": "page", "data": data, "has_more": False, "next_page": None}
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                with fake._lock:
+                    fake.requests[parsed.path] += 1
+                    count = sum(fake.requests.values())
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.throttle_every and count % fake.throttle_every == 0:
+                    with fake._lock:
+                        fake.throttled += 1
+                    return self._send(429, {"error": {"message": "Rate limit reached"}},
+                                      {"Retry-After": str(fake.retry_after)})
+                if parsed.path == "/v1/organization/costs":
+                    return self._send(200, fake._costs(query))
+                if parsed.path.startswith("/v1/organization/usage/"):
+                    return self._send(200, fake._usage(parsed.path, query))
+                return self._send(404, {"error": {"message": f"Unknown path {parsed.path}"}})
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.throttled = 0
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SMTPSink:
+    """Minimal plaintext SMTP server that accepts any AUTH PLAIN login and keeps messages."""
+
+    def __init__(self):
+        self.messages = []
+        self._server = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self.reply("220 localhost SMTP sink")
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    if verb in ("EHLO", "HELO"):
+                        self.reply("250-localhost")
+                        self.reply("250 AUTH PLAIN")
+                    elif verb == "AUTH":
+                        self.reply("235 Authentication successful")
+                    elif verb == "MAIL":
+                        sender, recipients = command.split(":", 1)[1].strip(" <>"), []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipients.append(command.split(":", 1)[1].strip(" <>"))
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        while True:
+                            data_line = self.rfile.readline()
+                            if data_line in (b".\r\n", b".\n", b""):
+                                break
+                            lines.append(data_line)
+                        sink.messages.append({"from": sender, "to": recipients, "data": b"".join(lines)})
+                        self.reply("250 OK: queued")
+                    elif verb in ("RSET", "NOOP"):
+                        self.reply("250 OK")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class WebhookSink:
+    """Accepts POSTed JSON alerts on any path and keeps them; `fail_next` forces 500s."""
+
+    def __init__(self):
+        self.requests = []
+        self.fail_next = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/hook"
+
+    def start(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if sink.fail_next > 0:
+                    sink.fail_next -= 1
+                    code = 500
+                else:
+                    sink.requests.append(json.loads(body or b"null"))
+                    code = 200
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,146 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Intercept, linear trend, and one dummy per weekday except Monday
+N_FEATURES = 8
+Z_95 = 1.96
+TREND_ORIGIN = 18262  # 2020-01-01 as an epoch day
+
+
+def _design(days):
+    # days: array of epoch-day numbers -> (len(days), N_FEATURES) design matrix
+    days = np.asarray(days, dtype=np.float64)
+    X = np.zeros((len(days), N_FEATURES))
+    X[:, 0] = 1.0
+    # Trend in years since 2020 keeps X'X well conditioned under repeated downdates
+    X[:, 1] = (days - TREND_ORIGIN) / 365.0
+    # 1970-01-01 was a Thursday; shift so Monday is weekday 0
+    weekday = (days.astype(np.int64) + 3) % 7
+    for wd in range(1, 7):
+        X[:, 1 + wd] = weekday == wd
+    return X
+
+
+class SpendForecaster:
+    """Daily-spend model (trend + weekday seasonality) fitted by least squares.
+
+    The normal equations (X'X, X'y, y'y) are maintained incrementally: adding or
+    revising a day is an O(p^2) rank-one update/downdate, and days leaving the
+    rolling window are downdated the same way. Solving the 8x8 system is only
+    redone after the data changed.
+    """
+
+    def __init__(self, window_days=90, ridge=1e-6):
+        self.window_days = window_days
+        self.ridge = ridge
+        self._lock = threading.Lock()
+        self._values = {}
+        self._xtx = np.zeros((N_FEATURES, N_FEATURES))
+        self._xty = np.zeros(N_FEATURES)
+        self._yty = 0.0
+        self._fit = None
+
+    def __len__(self):
+        return len(self._values)
+
+    def _apply(self, day, value, sign):
+        x = _design([day])[0]
+        self._xtx += sign * np.outer(x, x)
+        self._xty += sign * value * x
+        self._yty += sign * value * value
+
+    def load(self, days, values):
+        # Bulk, vectorised initialisation from stored history
+        days = np.asarray(days, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(days):
+            keep = days > days.max() - self.window_days
+            days, values = days[keep], values[keep]
+        with self._lock:
+            X = _design(days)
+            self._xtx = X.T @ X
+            self._xty = X.T @ values
+            self._yty = float(values @ values)
+            self._values = dict(zip(days.tolist(), values.tolist()))
+            self._fit = None
+
+    def update(self, day, value):
+        # Adds a new settled day or revises one that changed upstream
+        with self._lock:
+            old = self._values.get(day)
+            if old == value:
+                return
+            if old is not None:
+                self._apply(day, old, -1)
+            self._apply(day, value, 1)
+            self._values[day] = value
+            newest = max(self._values)
+            for expired in [d for d in self._values if d <= newest - self.window_days]:
+                self._apply(expired, self._values.pop(expired), -1)
+            self._fit = None
+
+    def mean_daily(self):
+        # Average settled daily spend in the window: X'y and X'X carry the sums in their intercept terms
+        with self._lock:
+            n = self._xtx[0, 0]
+            return float(self._xty[0] / n) if n else 0.0
+
+    def _solve(self):
+        if self._fit is None:
+            n = len(self._values)
+            if n < N_FEATURES:
+                return None
+            beta = np.linalg.solve(self._xtx + self.ridge * np.eye(N_FEATURES), self._xty)
+            sse = self._yty - 2 * beta @ self._xty + beta @ self._xtx @ beta
+            sigma2 = max(float(sse), 0.0) / max(n - N_FEATURES, 1)
+            self._fit = (beta, sigma2)
+        return self._fit
+
+    def forecast(self, balance, threshold, start_day, horizon=90, spent_today=0.0):
+        with self._lock:
+            fit = self._solve()
+        if fit is None:
+            return {"available": False, "reason": f"Need at least {N_FEATURES} settled days of history"}
+        beta, sigma2 = fit
+
+        days = np.arange(start_day, start_day + horizon)
+        daily = np.clip(_design(days) @ beta, 0.0, None)
+        # Today's settled spend is already in the balance
+        daily[0] = max(daily[0] - spent_today, 0.0)
+        cumulative = np.cumsum(daily)
+        # Daily errors treated as independent, so the cumulative variance grows linearly
+        band = Z_95 * np.sqrt(sigma2 * np.arange(1, horizon + 1))
+        headroom = balance - threshold
+
+        def crossing(spend):
+            hit = np.nonzero(spend >= headroom)[0]
+            return int(hit[0]) if len(hit) else None
+
+        def as_date(offset):
+            if offset is None:
+                return None
+            return (datetime(1970, 1, 1) + timedelta(days=int(start_day + offset))).strftime('%Y-%m-%d')
+
+        expected, earliest, latest = crossing(cumulative), crossing(cumulative + band), crossing(cumulative - band)
+        return {
+            "available": True,
+            "horizon_days": horizon,
+            "daily_mean": round(float(daily.mean()), 4),
+            "residual_std": round(float(np.sqrt(sigma2)), 4),
+            "weekday_effects": [round(float(b), 4) + 0.0 for b in np.concatenate(([0.0], beta[2:]))],
+            "depletion_date": as_date(expected),
+            "depletion_date_earliest": as_date(earliest),
+            "depletion_date_latest": as_date(latest),
+            "days_until_depletion": expected,
+            "projection": [
+                {
+                    "date": as_date(i),
+                    "balance": round(float(balance - cumulative[i]), 2),
+                    "lower": round(float(balance - cumulative[i] - band[i]), 2),
+                    "upper": round(float(balance - cumulative[i] + band[i]), 2),
+                }
+                for i in range(horizon)
+            ],
+        }
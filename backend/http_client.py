@@ -0,0 +1,217 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_RETRIES, UPSTREAM_SECONDS
+
+logger = logging.getLogger("OpenAIMonitor")
+# httpx logs every request at INFO; keep the monitor's own log readable
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Thread-safe token bucket. reserve() takes a token and returns how long to wait for it."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _BaseClient:
+    def __init__(self, base_url="https://api.openai.com/v1", connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=5, backoff_base=0.5, backoff_cap=30.0, rate=5.0, burst=5, pool_size=10,
+                 retry_after_cap=300.0, rate_limiter=None, sleep=None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # Longest Retry-After we honour; the server knows when it will take us back, so waits up
+        # to this are taken in full, and anything longer fails the request instead
+        self.retry_after_cap = retry_after_cap
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter or TokenBucket(rate, burst)
+        # Retry waits go through here so a simulated clock can skip them
+        self.sleep = sleep or time.sleep
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            base_url=os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
+            connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("OPENAI_READ_TIMEOUT", 30)),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", 5)),
+            retry_after_cap=float(os.getenv("OPENAI_MAX_RETRY_AFTER", 300)),
+            rate=float(os.getenv("OPENAI_RATE_LIMIT", 5)),
+            burst=int(os.getenv("OPENAI_RATE_BURST", 5)),
+            **kwargs,
+        )
+
+    def _url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def backoff_delay(self, attempt, retry_after=None):
+        # Full jitter, bounded by backoff_cap; an explicit Retry-After wins and is waited in full
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def retry_delay(self, path, response, attempt):
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None and retry_after > self.retry_after_cap:
+            raise UpstreamError(f"GET {path} returned {response.status_code} with Retry-After "
+                                f"{retry_after:.0f}s (over the {self.retry_after_cap:.0f}s limit)")
+        return self.backoff_delay(attempt, retry_after)
+
+
+class ApiClient(_BaseClient):
+    """Connection-pooled, rate-limited client for the OpenAI admin APIs.
+
+    One instance is shared by every caller so the keep-alive pool and the
+    token bucket apply process-wide.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, path, api_key, params=None):
+        url = self._url(path)
+        headers = {"Authorization": f"Bearer {api_key}"}
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, params=params,
+                                            timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                UPSTREAM_RESPONSES.labels(endpoint=path, status="error").inc()
+                if attempt == self.max_retries:
+                    raise UpstreamError(f"GET {path} failed after {attempt + 1} attempts: {e}") from e
+                UPSTREAM_RETRIES.labels(endpoint=path, reason="transport").inc()
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"GET {path} failed ({e}); retrying in {delay:.2f}s")
+                self.sleep(delay)
+                continue
+
+            UPSTREAM_SECONDS.labels(endpoint=path).observe(time.perf_counter() - started)
+            UPSTREAM_RESPONSES.labels(endpoint=path, status=str(response.status_code)).inc()
+            if response.status_code in RETRYABLE_STATUS:
+                if attempt == self.max_retries:
+                    raise UpstreamError(f"GET {path} returned {response.status_code} after {attempt + 1} attempts")
+                UPSTREAM_RETRIES.labels(endpoint=path, reason=str(response.status_code)).inc()
+                delay = self.retry_delay(path, response, attempt)
+                logger.warning(f"GET {path} returned {response.status_code}; retrying in {delay:.2f}s")
+                self.sleep(delay)
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                raise UpstreamError(str(e)) from e
+            return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncApiClient(_BaseClient):
+    """asyncio counterpart of ApiClient built on httpx; waits never block the event loop."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def get_json(self, path, api_key, params=None):
+        url = self._url(path)
+        headers = {"Authorization": f"Bearer {api_key}"}
+
+        for attempt in range(self.max_retries + 1):
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.perf_counter()
+            try:
+                response = await self.session.get(url, headers=headers, params=params)
+            except httpx.TransportError as e:
+                UPSTREAM_RESPONSES.labels(endpoint=path, status="error").inc()
+                if attempt == self.max_retries:
+                    raise UpstreamError(f"GET {path} failed after {attempt + 1} attempts: {e}") from e
+                UPSTREAM_RETRIES.labels(endpoint=path, reason="transport").inc()
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"GET {path} failed ({e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            UPSTREAM_SECONDS.labels(endpoint=path).observe(time.perf_counter() - started)
+            UPSTREAM_RESPONSES.labels(endpoint=path, status=str(response.status_code)).inc()
+            if response.status_code in RETRYABLE_STATUS:
+                if attempt == self.max_retries:
+                    raise UpstreamError(f"GET {path} returned {response.status_code} after {attempt + 1} attempts")
+                UPSTREAM_RETRIES.labels(endpoint=path, reason=str(response.status_code)).inc()
+                delay = self.retry_delay(path, response, attempt)
+                logger.warning(f"GET {path} returned {response.status_code}; retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                raise UpstreamError(str(e)) from e
+            return response.json()
+
+    async def close(self):
+        await self.session.aclose()
@@ -0,0 +1,363 @@
+import os
+import copy
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: the ledger is then only safe within one process
+    fcntl = None
+
+from metrics import LEDGER_LOAD_SECONDS, LEDGER_SAVE_SECONDS, LEDGER_BYTES
+
+logger = logging.getLogger("OpenAIMonitor")
+# Recent period keys remembered per budget rule (more than any settle window spans)
+RULE_PERIODS_KEPT = 8
+
+
+def _fsync_dir(path):
+    # Make a rename durable; not every platform/filesystem allows opening a directory
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _apply_deposit(state, entry):
+    state["total_deposited"] += entry["amount"]
+    # First deposit into an empty ledger starts tracking from then. Never earlier than the
+    # current start_date, though: spend before it was never fetched into the store.
+    if (state["total_deposited"] == entry["amount"] and state["historical_spend"] == 0
+            and int(entry["ts"]) >= state.get("start_date", 0)):
+        state["start_date"] = int(entry["ts"])
+    state["last_alert_sent"] = 0
+
+
+def _apply_sync(state, entry):
+    state["total_deposited"] = entry["total_deposited"]
+
+
+def _apply_alert_sent(state, entry):
+    state["last_alert_sent"] = entry["ts"]
+
+
+def _apply_rule_alert(state, entry):
+    # Besides the last alert, keeps when each recent period last alerted so a period that is
+    # re-evaluated after it closed does not alert twice
+    previous = state.setdefault("rule_alerts", {}).get(entry["rule"], {})
+    periods = dict(previous.get("periods", {}), **{entry["period"]: entry["ts"]})
+    state["rule_alerts"][entry["rule"]] = {
+        "ts": entry["ts"], "period": entry["period"], "value": entry["value"],
+        "periods": {key: periods[key] for key in sorted(periods)[-RULE_PERIODS_KEPT:]}}
+
+
+def _apply_anomaly_alert(state, entry):
+    state.setdefault("anomaly_alerts", {})[entry["series"]] = {
+        "ts": entry["ts"], "key": entry["key"], "value": entry["value"]}
+
+
+def _apply_update(state, entry):
+    state.update(entry["fields"])
+
+
+OPERATIONS = {
+    "deposit": _apply_deposit,
+    "sync": _apply_sync,
+    "alert_sent": _apply_alert_sent,
+    "rule_alert": _apply_rule_alert,
+    "anomaly_alert": _apply_anomaly_alert,
+    "update": _apply_update,
+}
+
+
+class Ledger:
+    """In-memory ledger state backed by a snapshot file plus an append-only journal.
+
+    The snapshot (ledger.json) is parsed once at startup and the journal is replayed
+    on top of it. Each mutation is a single fsync'd journal append; once the journal
+    grows past `compact_every` entries the state is written to a new snapshot via
+    atomic rename and the journal is truncated. Entries carry a sequence number and
+    the snapshot records the last one it includes, so a crash between the rename and
+    the truncate never replays an entry twice.
+
+    Several processes (uvicorn workers) may share the files: every access holds an
+    flock on `ledger.json.lock` and first applies whatever the others appended or
+    compacted since, so each process sees every mutation in sequence order. The lock
+    file holds a compaction counter; file timestamps are too coarse to detect a
+    snapshot that was replaced twice in quick succession.
+
+    Compaction appends the folded journal entries to `ledger.json.history`, so
+    every mutation stays available to `entries()` and `state_at()` for audits.
+    """
+
+    def __init__(self, path, initial_state, compact_every=100):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.history_path = f"{path}.history"
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._journal = None
+        self._lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock_depth = 0
+        # Bytes of the journal already applied to the in-memory state
+        self._offset = 0
+
+        with self._file_lock():
+            started = time.perf_counter()
+            self._state = self._read_snapshot(initial_state)
+            self._generation = self._read_generation()
+            self._seq = self._state.get("journal_seq", 0)
+            self._pending = self._replay()
+            LEDGER_LOAD_SECONDS.observe(time.perf_counter() - started)
+            if not os.path.exists(self.path):
+                self.compact()
+
+    @contextmanager
+    def _file_lock(self):
+        # Re-entrant within the process (record() may compact), exclusive across processes
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _read_generation(self):
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        data = os.read(self._lock_fd, 32)
+        return int(data) if data.strip() else 0
+
+    def _write_generation(self, generation):
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        os.ftruncate(self._lock_fd, 0)
+        os.write(self._lock_fd, str(generation).encode())
+        self._generation = generation
+
+    def _read_snapshot(self, initial_state):
+        if not os.path.exists(self.path):
+            return initial_state()
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            LEDGER_BYTES.labels(direction="read", kind="snapshot").inc(os.path.getsize(self.path))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading ledger: {e}")
+            return initial_state()
+        defaults = initial_state()
+        for key, value in defaults.items():
+            data.setdefault(key, value)
+        return data
+
+    def _replay(self):
+        # Applies journal entries past self._offset; returns how many were new
+        if not os.path.exists(self.journal_path):
+            self._offset = 0
+            return 0
+        size = os.path.getsize(self.journal_path)
+        if size < self._offset:
+            # Truncated by another process's compaction
+            self._offset = 0
+        applied = 0
+        intact = self._offset
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append (appends hold the lock, so
+                    # it cannot be in progress); everything before it is intact
+                    logger.warning(f"Discarding torn journal entry in {self.journal_path}")
+                    break
+                intact += len(line)
+                if entry["seq"] <= self._seq:
+                    continue
+                OPERATIONS[entry["op"]](self._state, entry)
+                self._seq = entry["seq"]
+                applied += 1
+        LEDGER_BYTES.labels(direction="read", kind="journal").inc(intact - self._offset)
+        if intact != size:
+            # Drop the torn tail so the next append starts on a fresh line
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(intact)
+                os.fsync(f.fileno())
+        self._offset = intact
+        self._state["journal_seq"] = self._seq
+        return applied
+
+    def _catch_up(self):
+        changed = False
+        generation = self._read_generation()
+        if generation != self._generation:
+            # Another process compacted; its snapshot holds everything up to its journal_seq
+            self._generation = generation
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reloading ledger: {e}")
+                data = None
+            if data is not None and data.get("journal_seq", 0) > self._seq:
+                self._state = data
+                self._seq = data["journal_seq"]
+                self._pending = 0
+                changed = True
+            self._offset = 0
+        applied = self._replay()
+        self._pending += applied
+        return changed or applied > 0
+
+    def catch_up(self):
+        # Applies changes made by other processes; True if the state changed
+        with self._file_lock():
+            return self._catch_up()
+
+    def snapshot(self):
+        with self._file_lock():
+            self._catch_up()
+            return copy.deepcopy(self._state)
+
+    def get(self, key, default=None):
+        with self._file_lock():
+            self._catch_up()
+            return copy.deepcopy(self._state.get(key, default))
+
+    def record(self, op, **fields):
+        # Appends one journal entry, then applies it to the in-memory state
+        return self.record_many([(op, fields)])
+
+    def record_many(self, mutations):
+        # Appends (op, fields) pairs in order with a single write and fsync, so a bulk
+        # import costs one disk flush rather than one per entry
+        with self._file_lock():
+            self._catch_up()
+            started = time.perf_counter()
+            entries = []
+            for op, fields in mutations:
+                if op not in OPERATIONS:
+                    raise ValueError(f"Unknown ledger operation '{op}'")
+                fields = dict(fields)
+                entries.append({"seq": self._seq + len(entries) + 1, "op": op,
+                                "ts": fields.pop("ts", time.time()), **fields})
+            if not entries:
+                return copy.deepcopy(self._state)
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a")
+            data = "".join(json.dumps(entry) + "\n" for entry in entries)
+            self._journal.write(data)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._offset += len(data)
+            LEDGER_SAVE_SECONDS.labels(kind="append").observe(time.perf_counter() - started)
+            LEDGER_BYTES.labels(direction="write", kind="journal").inc(len(data))
+
+            for entry in entries:
+                OPERATIONS[entry["op"]](self._state, entry)
+            self._seq = entries[-1]["seq"]
+            self._state["journal_seq"] = self._seq
+            self._pending += len(entries)
+            if self._pending >= self.compact_every:
+                self.compact()
+            return copy.deepcopy(self._state)
+
+    def entries(self):
+        # Every recorded entry still on disk (archived history, then journal), oldest first
+        with self._file_lock():
+            self._catch_up()
+            result, last_seq = [], 0
+            for path in (self.history_path, self.journal_path):
+                if not os.path.exists(path):
+                    continue
+                with open(path, "rb") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        # A crash between archiving and truncating leaves entries in both files
+                        if entry["seq"] > last_seq:
+                            result.append(entry)
+                            last_seq = entry["seq"]
+            return result
+
+    def state_at(self, initial_state, seq=None, ts=None):
+        # Rebuilds the state by replaying entries onto initial_state() up to a sequence
+        # number or timestamp (inclusive); also returns the first seq replayed
+        state = initial_state()
+        first_seq = None
+        for entry in self.entries():
+            if seq is not None and entry["seq"] > seq:
+                break
+            # Imported entries may carry back-dated timestamps, so filter rather than stop
+            if ts is not None and entry["ts"] > ts:
+                continue
+            if first_seq is None:
+                first_seq = entry["seq"]
+            OPERATIONS[entry["op"]](state, entry)
+        return state, first_seq
+
+    def compact(self):
+        with self._file_lock():
+            # The journal is about to be truncated, so fold in every entry other processes added
+            self._catch_up()
+            started = time.perf_counter()
+            # Bumped first: after a crash mid-compaction others at worst re-read an older snapshot
+            self._write_generation(self._read_generation() + 1)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._state, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+                written = f.tell()
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path)
+
+            # Entries up to journal_seq now live in the snapshot; keep them in the history archive
+            self._archive_journal()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            with open(self.journal_path, "w") as f:
+                os.fsync(f.fileno())
+            self._offset = 0
+            self._pending = 0
+            LEDGER_SAVE_SECONDS.labels(kind="compact").observe(time.perf_counter() - started)
+            LEDGER_BYTES.labels(direction="write", kind="snapshot").inc(written)
+
+    def _archive_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        if not data:
+            return
+        with open(self.history_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        LEDGER_BYTES.labels(direction="write", kind="history").inc(len(data))
+
+    def close(self):
+        with self._file_lock():
+            if self._pending:
+                self.compact()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        os.close(self._lock_fd)
@@ -1,12 +1,118 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from apscheduler.schedulers.background import BackgroundScheduler
-from monitor import OpenAIMonitor
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from events import StatusBroadcaster
+from export import FORMATS as EXPORT_FORMATS, encode_rows, export_columns
+from coordination import LeaderLease, SnapshotPending
+from metrics import HTTP_SECONDS, SNAPSHOT_AGE
 import os
+import time
+import asyncio
+import logging
 
-app = FastAPI(title="OpenAI Credit Monitor")
+logger = logging.getLogger("OpenAIMonitor")
+
+# One monitor per configured org (ORGS_CONFIG); the un-prefixed routes use the first one.
+# Both are built in the background after boot, see lifespan().
+registry = None
+monitor = None
+scheduler = None
+boot = {"state": "starting", "started_at": time.time(), "error": None}
+# With several uvicorn workers, only the lease holder polls upstream and sends alerts;
+# the others serve its persisted snapshot. No lease file means this process always leads.
+lease = LeaderLease.from_env()
+role = {"leader": lease is None}
+
+# Pushes snapshot changes to dashboards over Server-Sent Events
+broadcaster = StatusBroadcaster()
+
+def build_registry(follower=False):
+    # The monitor stack (NumPy, SQLite, ledger replay, breakdown load) is imported and
+    # constructed off the event loop so health checks answer while it loads
+    from orgs import OrgRegistry
+    return OrgRegistry.from_env(follower=follower)
+
+async def coordinate():
+    # Renews (or contends for) the lease well inside its TTL and switches roles on change.
+    # Nothing slow is awaited here: a late renewal lets a second worker take over while
+    # this one is still polling.
+    while True:
+        try:
+            leader = await asyncio.to_thread(lease.try_acquire)
+        except Exception as e:
+            logger.error(f"Leader lease check failed: {e}")
+            leader = False
+        if leader != role["leader"]:
+            role["leader"] = leader
+            registry.set_role(follower=not leader)
+            if leader:
+                logger.info(f"Acquired poller lease as {lease.holder}; taking over refreshes and alerts")
+                scheduler.resume()
+                registry.start_warm_up()
+            else:
+                logger.warning(f"Lost poller lease; following {lease.holder_of()}")
+                scheduler.pause()
+        await asyncio.sleep(lease.ttl / 3)
+
+async def sync_workers():
+    # Separate from coordinate() so reading the shared ledger and snapshot never delays a renewal
+    while True:
+        await registry.sync()
+        await asyncio.sleep(lease.ttl / 3)
+
+async def start_services():
+    global registry, monitor, scheduler
+    try:
+        if lease is not None:
+            role["leader"] = await asyncio.to_thread(lease.try_acquire)
+            logger.info(f"Worker {lease.holder} starting as {'leader' if role['leader'] else 'follower'}")
+        registry = await asyncio.to_thread(build_registry, not role["leader"])
+    except Exception as e:
+        logger.error(f"Startup failed: {e}")
+        boot.update(state="failed", error=str(e))
+        return
+    monitor = registry.default
+    for org_monitor in registry.monitors.values():
+        broadcaster.attach(org_monitor)
+
+    # Scheduler: jobs run as coroutines on the server's event loop, not in worker threads
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    scheduler = AsyncIOScheduler()
+    # Tick often but cheaply: each org is only checked once its adaptive interval has elapsed
+    scheduler.add_job(registry.check_due, 'interval', seconds=float(os.getenv("POLL_TICK_SECONDS", 15)))
+    scheduler.start(paused=not role["leader"])
+    boot["state"] = "ready"
+    logger.info(f"Started in {time.time() - boot['started_at']:.2f}s; catching up in the background")
+    if role["leader"]:
+        registry.start_warm_up()
+    if lease is not None:
+        syncing = asyncio.create_task(sync_workers())
+        try:
+            await coordinate()
+        finally:
+            syncing.cancel()
+
+@asynccontextmanager
+async def lifespan(app):
+    startup = asyncio.create_task(start_services())
+    yield
+    startup.cancel()
+    if scheduler is not None:
+        scheduler.shutdown()
+    if registry is not None:
+        await registry.close()
+    if lease is not None:
+        # Hand over immediately instead of making the next leader wait out the TTL
+        if role["leader"]:
+            lease.release()
+        lease.close()
+
+app = FastAPI(title="OpenAI Credit Monitor", lifespan=lifespan)
 
 # CORS for development
 app.add_middleware(
@@ -15,39 +121,205 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+# Compress JSON responses (SSE streams are excluded by the middleware)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
-monitor = OpenAIMonitor()
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not raw path, so per-org URLs don't explode the series count
+    route = request.scope.get("route")
+    HTTP_SECONDS.labels(
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    ).observe(time.perf_counter() - started)
+    return response
 
-# Scheduler
-scheduler = BackgroundScheduler()
-# Run the check every 2 minutes
-scheduler.add_job(monitor.check_and_alert, 'interval', minutes=2)
-scheduler.start()
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
 
 class DepositRequest(BaseModel):
     amount: float
 
+def get_registry():
+    if registry is None:
+        detail = f"Startup failed: {boot['error']}" if boot["state"] == "failed" else "Starting up"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "1"})
+    return registry
+
+@app.exception_handler(SnapshotPending)
+async def snapshot_pending(request: Request, exc: SnapshotPending):
+    # A follower that started before the leader published its first snapshot
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+def get_org_monitor(org: str = None):
+    if org is None:
+        return get_registry().default
+    org_monitor = get_registry().get(org)
+    if org_monitor is None:
+        raise HTTPException(status_code=404, detail=f"Unknown org '{org}'")
+    return org_monitor
+
+def snapshot_etag(status):
+    # Derived from the snapshot alone, so every worker serving the leader's snapshot agrees
+    # and a revision counter restarted without a saved snapshot never repeats an old tag
+    return f'"{status["revision"]}-{status.get("changed_at", status["as_of"])}{"-stale" if status["stale"] else ""}"'
+
+def etag_matches(header, etag):
+    # If-None-Match is "*" or a comma-separated list of tags; GET uses weak comparison
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def conditional(request: Request, response: Response, status):
+    # Returns a bodiless 304 when the client already holds this snapshot revision
+    etag = snapshot_etag(status)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @app.get("/api/status")
-def get_status():
-    status = monitor.get_balance()
-    # Include the configured threshold in the response
-    status["threshold"] = monitor.threshold
-    return status
+async def get_status(request: Request, response: Response):
+    # Served from the in-memory snapshot; only refreshes upstream when older than SNAPSHOT_MAX_AGE
+    status = await get_org_monitor().get_status()
+    return conditional(request, response, status) or status
+
+@app.get("/api/history")
+async def get_history(request: Request, response: Response, org: str = None, limit: int = Query(24, ge=1, le=500),
+                      offset: int = Query(0, ge=0), from_month: str = Query(None, alias="from", pattern=MONTH_PATTERN),
+                      to_month: str = Query(None, alias="to", pattern=MONTH_PATTERN)):
+    history_monitor = get_org_monitor(org)
+    status = await history_monitor.get_status()
+    not_modified = conditional(request, response, status)
+    if not_modified:
+        return not_modified
+    page = history_monitor.get_history(from_month, to_month, limit, offset)
+    page["limit"] = limit
+    page["offset"] = offset
+    return page
+
+@app.get("/api/breakdown")
+async def get_breakdown(from_day: str = Query(..., alias="from", pattern=DAY_PATTERN),
+                        to_day: str = Query(..., alias="to", pattern=DAY_PATTERN),
+                        group_by: str = "project_id,line_item", top: int = Query(None, ge=1), org: str = None):
+    breakdown_monitor = get_org_monitor(org)
+    keys = [key.strip() for key in group_by.split(",") if key.strip()]
+    try:
+        # Vectorized, but a multi-year range is still worth keeping off the event loop
+        return await asyncio.to_thread(breakdown_monitor.get_breakdown, from_day, to_day, keys, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/export")
+async def export_costs(from_day: str = Query(..., alias="from", pattern=DAY_PATTERN),
+                       to_day: str = Query(..., alias="to", pattern=DAY_PATTERN),
+                       format: str = Query("csv", pattern="^(csv|ndjson)$"), group_by: str = "", org: str = None):
+    # Streams daily rows straight from the local cost store; the upstream API is never called
+    export_monitor = get_org_monitor(org)
+    keys = [key.strip() for key in group_by.split(",") if key.strip()]
+    try:
+        rows = export_monitor.export_costs(from_day, to_day, keys)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"costs-{export_monitor.name}-{from_day}-{to_day}.{format}"
+    return StreamingResponse(
+        encode_rows(rows, export_columns(keys), format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/budgets")
+async def get_budgets(org: str = None):
+    # Current-period value of every budget rule plus its last alert
+    return get_org_monitor(org).get_budgets()
+
+@app.get("/api/anomalies")
+async def get_anomalies(limit: int = Query(50, ge=1, le=200), org: str = None):
+    return get_org_monitor(org).get_anomalies(limit)
+
+@app.get("/api/forecast")
+async def get_forecast(horizon: int = Query(90, ge=1, le=730), org: str = None):
+    forecast_monitor = get_org_monitor(org)
+    await forecast_monitor.get_status()
+    return forecast_monitor.get_forecast(horizon)
 
 @app.post("/api/deposit")
-def add_deposit(deposit: DepositRequest):
-    return monitor.add_deposit(deposit.amount)
+async def add_deposit(deposit: DepositRequest):
+    return await get_org_monitor().add_deposit(deposit.amount)
 
 @app.post("/api/sync")
-def sync_balance(sync_request: DepositRequest):
-    return monitor.sync_balance(sync_request.amount)
+async def sync_balance(sync_request: DepositRequest):
+    return await get_org_monitor().sync_balance(sync_request.amount)
 
 @app.post("/api/check-now")
-def check_now(background_tasks: BackgroundTasks):
-    background_tasks.add_task(monitor.check_and_alert)
+async def check_now(background_tasks: BackgroundTasks):
+    background_tasks.add_task(get_org_monitor().check_and_alert)
     return {"message": "Check triggered"}
 
+@app.get("/api/health")
+async def health():
+    # Liveness plus catch-up progress; answers as soon as the process is up
+    result = {"status": boot["state"], "uptime": round(time.time() - boot["started_at"], 3)}
+    if boot["error"]:
+        result["error"] = boot["error"]
+    if lease is not None:
+        result["role"] = "leader" if role["leader"] else "follower"
+        result["worker"] = lease.holder
+    if registry is not None:
+        result["orgs"] = registry.progress()
+    return result
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format; snapshot age is sampled at scrape time
+    now = time.time()
+    for name, org_monitor in (registry.monitors.items() if registry is not None else ()):
+        snapshot = org_monitor._snapshot
+        if snapshot is not None:
+            SNAPSHOT_AGE.labels(org=name).set(now - snapshot["as_of"])
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/api/alerts/deliveries")
+async def alert_deliveries(limit: int = Query(50, ge=1, le=200)):
+    # Newest first
+    dispatcher = get_registry().dispatcher
+    results = list(dispatcher.results)[-limit:]
+    return {"items": results[::-1], "pending": dispatcher.pending()}
+
+@app.get("/api/orgs")
+async def orgs_overview():
+    return await get_registry().overview()
+
+@app.get("/api/orgs/{org}/status")
+async def org_status(org: str, request: Request, response: Response):
+    status = await get_org_monitor(org).get_status()
+    return conditional(request, response, status) or status
+
+@app.post("/api/orgs/{org}/deposit")
+async def org_deposit(org: str, deposit: DepositRequest):
+    return await get_org_monitor(org).add_deposit(deposit.amount)
+
+@app.post("/api/orgs/{org}/sync")
+async def org_sync(org: str, sync_request: DepositRequest):
+    return await get_org_monitor(org).sync_balance(sync_request.amount)
+
+@app.get("/api/stream")
+async def stream_status(request: Request, org: str = None):
+    stream_monitor = get_org_monitor(org)
+    return StreamingResponse(
+        broadcaster.stream(stream_monitor, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Serve Frontend (Production Mode)
 # We assume the frontend build is in ../frontend/build
 frontend_build_path = os.path.join(os.path.dirname(__file__), "../frontend/build")
@@ -55,7 +327,3 @@ if os.path.exists(frontend_build_path):
     app.mount("/", StaticFiles(directory=frontend_build_path, html=True), name="static")
 else:
     print("Frontend build not found. Running in API-only mode.")
-
-@app.on_event("shutdown")
-def shutdown_event():
-    scheduler.shutdown()
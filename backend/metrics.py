@@ -0,0 +1,72 @@
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger("OpenAIMonitor")
+
+# Refreshes range from one page to a multi-year backfill
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+COST_FETCH_SECONDS = Histogram(
+    "monitor_cost_fetch_seconds", "Time to bring the cost store up to date", ["org"], buckets=FETCH_BUCKETS)
+COST_PAGES = Histogram(
+    "monitor_cost_pages_per_refresh", "Costs API pages fetched per refresh", ["org"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+REFRESH_FAILURES = Counter(
+    "monitor_cost_window_failures_total", "Backfill windows that failed after all retries", ["org"])
+STAGE_SECONDS = Histogram(
+    "monitor_stage_seconds", "Duration of each refresh stage", ["org", "stage"], buckets=FETCH_BUCKETS)
+
+UPSTREAM_RESPONSES = Counter(
+    "monitor_upstream_responses_total", "Upstream responses by status code ('error' for transport failures)",
+    ["endpoint", "status"])
+UPSTREAM_RETRIES = Counter(
+    "monitor_upstream_retries_total", "Upstream requests retried", ["endpoint", "reason"])
+UPSTREAM_SECONDS = Histogram(
+    "monitor_upstream_request_seconds", "Latency of single upstream requests", ["endpoint"], buckets=FETCH_BUCKETS)
+
+LEDGER_LOAD_SECONDS = Histogram(
+    "monitor_ledger_load_seconds", "Time to read the ledger snapshot and replay its journal", buckets=IO_BUCKETS)
+LEDGER_SAVE_SECONDS = Histogram(
+    "monitor_ledger_save_seconds", "Time to persist a ledger change", ["kind"], buckets=IO_BUCKETS)
+LEDGER_BYTES = Counter(
+    "monitor_ledger_bytes_total", "Bytes read from or written to the ledger files", ["direction", "kind"])
+
+SNAPSHOT_AGE = Gauge(
+    "monitor_snapshot_age_seconds", "Age of the cost snapshot served by the API", ["org"])
+
+SMTP_SECONDS = Histogram(
+    "monitor_smtp_send_seconds", "Time to deliver an alert email", buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+SMTP_FAILURES = Counter(
+    "monitor_smtp_failures_total", "Failed alert email delivery attempts")
+ALERT_DELIVERIES = Counter(
+    "monitor_alert_deliveries_total", "Alert deliveries by channel and final outcome", ["channel", "outcome"])
+
+HTTP_SECONDS = Histogram(
+    "monitor_http_request_seconds", "API request latency by route", ["method", "route", "status"])
+
+# Callables invoked as hook(org, stage, seconds) after every timed stage
+stage_hooks = []
+
+
+def add_stage_hook(hook):
+    stage_hooks.append(hook)
+
+
+@contextmanager
+def stage(org, name):
+    # Times a block into STAGE_SECONDS and reports it to any registered hooks
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(org=org, stage=name).observe(elapsed)
+        for hook in stage_hooks:
+            try:
+                hook(org, name, elapsed)
+            except Exception as e:
+                logger.error(f"Stage timing hook failed: {e}")
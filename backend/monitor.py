@@ -1,12 +1,24 @@
 import os
 import json
 import time
-import smtplib
-import requests
-from email.message import EmailMessage
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
 from dotenv import load_dotenv
+from store import CostStore
+from ledger import Ledger
+from breakdown import CostColumns, day_number
+from forecast import SpendForecaster
+from usage import USAGE_ENDPOINTS, PAGE_LIMITS, BUCKET_SECONDS, PriceTable, BurnRateWindow
+from http_client import ApiClient, UpstreamError
+from metrics import COST_FETCH_SECONDS, COST_PAGES, REFRESH_FAILURES, stage
+from notifications import AlertDispatcher
+from coordination import SnapshotPending
+from scheduling import AdaptivePoller
+from budgets import BudgetEngine, alert_allowed, parse_quiet_hours
+from anomaly import AnomalyDetector
 
 # Load environment variables
 load_dotenv()
@@ -15,292 +27,924 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("OpenAIMonitor")
 
+COSTS_PAGE_LIMIT = 100
+# Seconds between checks for a newer leader snapshot while following
+FOLLOW_INTERVAL = 1.0
+# Each backfill window spans one full page of daily buckets
+WINDOW_SECONDS = COSTS_PAGE_LIMIT * 86400
+
+
 class OpenAIMonitor:
-    def __init__(self, ledger_file="ledger.json"):
+    def __init__(self, ledger_file="ledger.json", store_file=None, client=None, name="default",
+                 api_key=None, threshold=None, recipient_email=None, dispatcher=None, snapshot_file=None,
+                 follower=False, clock=None):
+        # Per-org settings fall back to the single-org environment variables
+        self.name = name
+        # Source of "now" for polling, alerting and bucket cut-offs; simulate.py injects a virtual one
+        self.clock = clock or time.time
         self.ledger_file = ledger_file
-        self.api_key = os.getenv("OPENAI_ADMIN_KEY")
-        self.smtp_user = os.getenv("SMTP_EMAIL")
-        self.smtp_pass = os.getenv("SMTP_PASSWORD")
-        self.smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        self.smtp_port = int(os.getenv("SMTP_PORT", 587))
-        self.threshold = float(os.getenv("ALERT_THRESHOLD", 10.0))
-        self.recipient_email = os.getenv("ALERT_RECIPIENT_EMAIL", self.smtp_user)
+        self.store_file = store_file or os.getenv("COST_STORE_FILE", "costs.db")
+        # Last published snapshot, reloaded at startup so the API can answer before catching up
+        self.snapshot_file = snapshot_file or f"{os.path.splitext(ledger_file)[0]}.snapshot.json"
+        # Only the default org may fall back to OPENAI_ADMIN_KEY: any other org would silently
+        # report (and keep a ledger of) the default org's spend
+        self.api_key = api_key or (os.getenv("OPENAI_ADMIN_KEY") if name == "default" else None)
+        self.threshold = float(threshold if threshold is not None else os.getenv("ALERT_THRESHOLD", 10.0))
+        self.recipient_email = recipient_email or os.getenv("ALERT_RECIPIENT_EMAIL", os.getenv("SMTP_EMAIL"))
+        # Minimum gap between repeated alerts, and local hours during which none are sent
+        self.alert_throttle = float(os.getenv("ALERT_THROTTLE_SECONDS", 7200))
+        self.quiet_hours = parse_quiet_hours(os.getenv("ALERT_QUIET_HOURS", "21-6"))
+        # Minimum gap between anomaly alerts for the same series
+        self.anomaly_throttle = float(os.getenv("ANOMALY_THROTTLE_SECONDS", self.alert_throttle))
+        self._held_anomalies = {}
+        self.anomaly_warmup_days = int(os.getenv("ANOMALY_WARMUP_DAYS", 30))
+        # Per-project / per-period spend rules (BUDGET_RULES_FILE), each with its own alert state
+        self.budgets = BudgetEngine.from_env(self.name)
+        # Alerts are queued and delivered on a background thread; checks never wait on SMTP
+        self.dispatcher = dispatcher or AlertDispatcher.from_env()
+        # Pooled keep-alive client with backoff and a shared rate limiter
+        self.client = client or ApiClient.from_env()
+        # Daily buckets ending within this many days of today can still be revised upstream
+        self.settle_days = int(os.getenv("COST_SETTLE_DAYS", 2))
+        # Concurrent windows fetched when catching up on a long range
+        self.backfill_workers = int(os.getenv("BACKFILL_WORKERS", 4))
+        # Intraday spend is estimated from fine-grained usage buckets priced locally
+        self.intraday_bucket = os.getenv("INTRADAY_BUCKET", "1h")
+        self.prices = PriceTable.from_file(os.getenv("PRICE_TABLE_FILE", os.path.join(os.path.dirname(__file__), "prices.json")))
+        self.burn_window = BurnRateWindow(float(os.getenv("BURN_WINDOW_HOURS", 6)) * 3600)
+        self._usage_cursor = {}
+        # API reads are served from the shared snapshot while it is younger than this (seconds)
+        self.max_staleness = float(os.getenv("SNAPSHOT_MAX_AGE", 300))
+        # Scheduled checks run more often as the projected balance nears the threshold
+        self.poller = AdaptivePoller.from_env()
+        self._intraday_failed = False
+        self._aggregate_key = None
+        # When the last complete cost fetch finished, and why the latest one was not complete
+        self._fetched_ok_at = None
+        self._fetch_error = None
+
+        # Shared cost snapshot, refreshed by the scheduler and coalesced across callers
+        self._snapshot = None
+        self._snapshot_costs = None
+        self._revision = 0
+        self._changed_at = 0
+        self._fetch_generation = 0
+        self._refresh_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        # Costs API pages fetched since startup, for the pages-per-refresh histogram
+        self._pages_fetched = 0
+        # True while serving a snapshot from a previous run; cleared by the first completed refresh
+        self.warming = False
+        self.progress = {"state": "idle", "windows_total": 0, "windows_done": 0, "windows_failed": 0,
+                         "started_at": None, "finished_at": None, "error": None}
+        # Callables invoked as listener(monitor, status) whenever a new snapshot is published
+        self.listeners = []
+        # Followers never poll upstream; they serve the snapshot persisted by the leader process
+        self.follower = follower
+        self._followed_file = None
+        self._follow_checked = 0.0
         
         if self.api_key:
-            logger.info(f"API Key loaded: {self.api_key[:8]}... (Length: {len(self.api_key)})")
+            logger.info(f"[{self.name}] API Key loaded")
         else:
-            logger.error("API Key NOT loaded from environment!")
+            logger.error(f"[{self.name}] API Key NOT loaded from environment!")
             
-        logger.info(f"Alert Threshold set to: ${self.threshold}")
-        logger.info(f"SMTP Config: {self.smtp_server}:{self.smtp_port} (User: {self.smtp_user})")
-
-        self._ensure_ledger()
-
-    def _ensure_ledger(self):
-        if not os.path.exists(self.ledger_file):
-            initial_deposit = float(os.getenv("INITIAL_TOTAL_DEPOSITED", 0.0))
-            # Default to 90 days ago to ensure history is populated on fresh deploy
-            ninety_days_ago = int(time.time()) - (90 * 86400)
-            initial_state = {
-                "total_deposited": initial_deposit,
-                "start_date": ninety_days_ago, 
-                "historical_spend": 0.0,
-                "monthly_history": {},
-                "last_alert_sent": 0
-            }
-            self._save_ledger(initial_state)
-            if initial_deposit > 0:
-                logger.info(f"Initialized ledger from Environment Variable with Total Deposit: ${initial_deposit}")
+        logger.info(f"[{self.name}] Alert Threshold set to: ${self.threshold}")
 
-    def _load_ledger(self):
+        self.ledger = Ledger(self.ledger_file, self._initial_ledger)
+        self.store = CostStore(self.store_file)
+        self._load_columns()
+        self._restore_snapshot()
+
+    def _load_columns(self):
+        # Per-project / line-item spend, loaded once and kept current by each refresh
+        breakdown = CostColumns()
+        breakdown.load(self.store.iter_line_items())
+        # Depletion forecast over settled days, updated as buckets land
+        forecaster = SpendForecaster(window_days=int(os.getenv("FORECAST_WINDOW_DAYS", 90)))
+        series = self.store.daily_series(until=int(self.clock()) // 86400 * 86400)
+        forecaster.load([start_t // 86400 for start_t, _ in series], [amount for _, amount in series])
+        self.breakdown, self.forecaster = breakdown, forecaster
+        # Budget totals only need the current and previous month
+        now = self.clock()
+        self.budgets.load(self.store.iter_line_items(since=self.budgets.window_start(now) * 86400), now)
+        self.anomalies = self._primed_detector()
+        self._columns_fetched_at = self.store.last_fetched_at()
+
+    def _settled_before(self):
+        # Daily buckets ending at or before this can no longer be revised upstream
+        return int(self.clock()) // 86400 * 86400 - self.settle_days * 86400
+
+    def _primed_detector(self):
+        # Seeds the per-series statistics from the last ANOMALY_WARMUP_DAYS settled days;
+        # older history is never replayed and nothing found here is alerted on
+        detector = AnomalyDetector.from_env()
+        settled_before = self._settled_before()
+        self._observe_days(detector, settled_before - self.anomaly_warmup_days * 86400, settled_before)
+        return detector
+
+    def _observe_days(self, detector, since, until, now=None):
+        # Scores the stored days in [since, until) on the total and per-project series
+        days = {}
+        if detector.per_project:
+            for start_t, project_id, _, cents in self.store.iter_line_items(since, until):
+                projects = days.setdefault(start_t, {})
+                projects[project_id] = projects.get(project_id, 0.0) + cents / 100
+        found = []
+        for start_t, amount in self.store.daily_series(since=since, until=until):
+            found.append(detector.observe("total", start_t, amount, now))
+            for project_id, value in days.get(start_t, {}).items():
+                found.append(detector.observe(f"project:{project_id}", start_t, value, now))
+        return [anomaly for anomaly in found if anomaly]
+
+    def _read_snapshot(self):
+        with open(self.snapshot_file, "r") as f:
+            saved = json.load(f)
+        return saved["status"], saved["costs"]
+
+    def _adopt_snapshot(self, status, costs):
+        with self._state_lock:
+            self._revision = status.get("revision", 0)
+            self._changed_at = status.get("changed_at", status.get("as_of", 0))
+            self._snapshot_costs = costs
+            self._history_keys = [row["key"] for row in reversed(costs["history"])]
+            self._snapshot = status
+            self._fetched_ok_at = status.get("as_of")
+
+    def _restore_snapshot(self):
+        # Serve the previous run's snapshot, or one rebuilt from the local store, until a refresh lands
+        if self.follower:
+            self._follow()
+            return
+        try:
+            status, costs = self._read_snapshot()
+        except FileNotFoundError:
+            fetched_at = self.store.last_fetched_at()
+            if fetched_at is None:
+                return
+            self.warming = True
+            costs = self._costs_from_store(self._load_ledger(), datetime.utcfromtimestamp(self.clock()))
+            self._fetched_ok_at = fetched_at
+            self._publish(costs)
+            logger.info(f"[{self.name}] Rebuilt snapshot from the local store (as of {fetched_at})")
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"[{self.name}] Error loading snapshot {self.snapshot_file}: {e}")
+            return
+        self.warming = True
+        status["warming"] = True
+        self._adopt_snapshot(status, costs)
+        logger.info(f"[{self.name}] Restored snapshot from {self.snapshot_file} (as of {status['as_of']})")
+
+    def _follow(self):
+        # Adopts the leader's snapshot if it was replaced since we last looked; the
+        # breakdown and forecast catch up from the shared store when it has new buckets
+        self._follow_checked = time.time()
+        try:
+            st = os.stat(self.snapshot_file)
+        except FileNotFoundError:
+            return False
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if identity == self._followed_file:
+            return False
+        try:
+            status, costs = self._read_snapshot()
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"[{self.name}] Error reading leader snapshot {self.snapshot_file}: {e}")
+            return False
+        self._followed_file = identity
+        fetched_at = self.store.last_fetched_at()
+        if fetched_at != self._columns_fetched_at:
+            self._catch_up_columns(fetched_at)
+        self.warming = status.get("warming", False)
+        self._adopt_snapshot(status, costs)
+        self._notify(status)
+        return True
+
+    def _follow_due(self):
+        # Claims the next check, so a burst of concurrent readers stats the file only once
+        now = time.time()
+        if now - self._follow_checked < FOLLOW_INTERVAL:
+            return False
+        self._follow_checked = now
+        return True
+
+    def _followed_status(self):
+        if self._snapshot is None:
+            raise SnapshotPending(f"[{self.name}] Waiting for the leader's first snapshot")
+        return dict(self._snapshot)
+
+    def set_follower(self, follower):
+        # Switches roles when leadership changes hands; a new follower re-reads the leader's
+        # snapshot right away, a new leader catches up from upstream on its next refresh
+        self.follower = follower
+        self._followed_file = None
+        self._follow_checked = 0.0
+        self._aggregate_key = None
+        if not follower:
+            self.warming = True
+
+    def _persist_snapshot(self, status, costs):
+        tmp_path = f"{self.snapshot_file}.tmp"
         try:
-            with open(self.ledger_file, "r") as f:
-                data = json.load(f)
-                if "historical_spend" not in data:
-                    data["historical_spend"] = 0.0
-                if "monthly_history" not in data:
-                    data["monthly_history"] = {}
-                return data
-        except Exception as e:
-            logger.error(f"Error loading ledger: {e}")
-            # Default to 90 days ago to rebuild history on fresh start
-            ninety_days_ago = int(time.time()) - (90 * 86400)
-            return {
-                "total_deposited": float(os.getenv("INITIAL_TOTAL_DEPOSITED", 0.0)), 
-                "start_date": ninety_days_ago, 
-                "historical_spend": 0.0, 
-                "monthly_history": {},
-                "last_alert_sent": 0
-            }
-
-    def _save_ledger(self, data):
-        with open(self.ledger_file, "w") as f:
-            json.dump(data, f, indent=2)
+            with open(tmp_path, "w") as f:
+                json.dump({"status": status, "costs": costs}, f)
+            os.replace(tmp_path, self.snapshot_file)
+        except OSError as e:
+            logger.error(f"[{self.name}] Error saving snapshot: {e}")
+
+    def _initial_ledger(self):
+        initial_deposit = float(os.getenv("INITIAL_TOTAL_DEPOSITED", 0.0))
+        if initial_deposit > 0:
+            logger.info(f"Initialized ledger from Environment Variable with Total Deposit: ${initial_deposit}")
+        # Default to 90 days ago to ensure history is populated on fresh deploy
+        ninety_days_ago = int(self.clock()) - (90 * 86400)
+        return {
+            "total_deposited": initial_deposit,
+            "start_date": ninety_days_ago, 
+            "historical_spend": 0.0,
+            "monthly_history": {},
+            "last_alert_sent": 0,
+            "rule_alerts": {},
+            "anomaly_alerts": {}
+        }
+
+    def _load_ledger(self):
+        # In-memory copy; the file is only parsed once, at startup
+        return self.ledger.snapshot()
 
     def add_deposit(self, amount: float):
-        ledger = self._load_ledger()
-        ledger["total_deposited"] += amount
-        if ledger["total_deposited"] == amount and ledger["historical_spend"] == 0: 
-             ledger["start_date"] = int(time.time())
-        
-        ledger["last_alert_sent"] = 0
-        self._save_ledger(ledger)
+        ledger = self.ledger.record("deposit", amount=amount, ts=self.clock())
         logger.info(f"Added ${amount}. New Total Deposit: ${ledger['total_deposited']}")
+        # Deposits only move the balance, so rebuild the snapshot from the cached costs
+        if self._snapshot_costs is not None:
+            self._publish(self._snapshot_costs)
         return ledger
 
+    def add_deposits(self, deposits):
+        # Bulk add_deposit: dicts of amount plus optional ts/note, written as one journal append
+        ledger = self.ledger.record_many([("deposit", {"ts": self.clock(), **fields}) for fields in deposits])
+        logger.info(f"Added {len(deposits)} deposits. New Total Deposit: ${ledger['total_deposited']}")
+        if self._snapshot_costs is not None:
+            self._publish(self._snapshot_costs)
+        return ledger
+
+    def offline_status(self):
+        # Balance from the ledger and the local cost store only: nothing is fetched or published
+        ledger = self._load_ledger()
+        costs = self._costs_from_store(ledger, datetime.utcfromtimestamp(self.clock()))
+        return {
+            "balance": round(ledger["total_deposited"] - costs["total"], 2),
+            "total_deposited": ledger["total_deposited"],
+            "total_spend": round(costs["total"], 2),
+            "history": costs["history"],
+            "as_of": self.store.last_fetched_at(),
+        }
+
     def sync_balance(self, actual_balance: float):
-        costs = self.get_aggregated_costs()
-        current_total_spend = costs["total"]
+        self.refresh()
+        return self._apply_sync(actual_balance)
+
+    def _apply_sync(self, actual_balance):
+        current_total_spend = self._snapshot_costs["total"]
         new_total_deposited = actual_balance + current_total_spend
         
-        ledger = self._load_ledger()
-        ledger["total_deposited"] = new_total_deposited
-        self._save_ledger(ledger)
+        self.ledger.record("sync", total_deposited=new_total_deposited, balance=actual_balance, ts=self.clock())
         logger.info(f"Synced Balance to ${actual_balance}. Recalculated Total Deposit: ${new_total_deposited}")
-        return self.get_balance()
+        return self._publish(self._snapshot_costs)
+
+    def _plan_fetch(self):
+        ledger = self._load_ledger()
+        # Spend before start_date was banked by the old ledger format and is kept as a
+        # fixed baseline; everything from start_date onward lives in the bucket store.
+        baseline_cutoff = ledger.get("start_date", int(self.clock()) - 86400)
+
+        today_start = int(self.clock()) // 86400 * 86400
+        settled_before = today_start - self.settle_days * 86400
+
+        # Only re-fetch from the last settled bucket: that covers new days plus the
+        # still-mutable recent ones, so a refresh costs O(new days).
+        query_start = self.store.last_end_before(settled_before) or baseline_cutoff
+        return ledger, max(query_start, baseline_cutoff)
+
+    def _costs_params(self, query_start, window_end):
+        return {
+            "start_time": int(query_start),
+            "end_time": int(window_end),
+            "bucket_width": "1d",
+            "group_by": ["project_id", "line_item"],
+            "limit": COSTS_PAGE_LIMIT
+        }
+
+    def _parse_page(self, data, query_start):
+        # Returns (rows, next_start); next_start is None once the window is exhausted
+        buckets = data.get("data", [])
+        if not buckets:
+            return [], None
+
+        last_bucket_end = query_start
+        rows = []
+
+        for bucket in buckets:
+            start_t = bucket.get("start_time")
+            end_t = bucket.get("end_time")
+
+            if end_t and end_t > last_bucket_end:
+                last_bucket_end = end_t
+
+            if not start_t or not end_t:
+                continue
+
+            bucket_spend = 0.0
+            items = {}
+            for result in bucket.get("results", []):
+                val = float(result.get("amount", {}).get("value", 0.0))
+                bucket_spend += val
+                key = (result.get("project_id") or "", result.get("line_item") or "")
+                items[key] = items.get(key, 0.0) + val
+            rows.append((start_t, end_t, bucket_spend, [(p, li, v) for (p, li), v in items.items()]))
+
+        if len(buckets) < COSTS_PAGE_LIMIT:
+            return rows, None
+        if last_bucket_end <= query_start:
+            return rows, query_start + 86400
+        return rows, last_bucket_end
+
+    def _backfill_windows(self, start_time, end_time):
+        # Independent [start, end) windows covering the whole range with no overlap. Inner
+        # boundaries sit on UTC midnight so no daily bucket straddles two windows.
+        start_time, end_time = int(start_time), int(end_time)
+        boundaries = [start_time] + list(range(start_time // 86400 * 86400 + WINDOW_SECONDS, end_time, WINDOW_SECONDS))
+        return list(zip(boundaries, boundaries[1:] + [end_time]))
+
+    def _merge_windows(self, windows, results):
+        # results[i] holds window i's rows, or None if it failed. Only the contiguous prefix
+        # of successful windows is stored: a hole would otherwise be skipped by later
+        # incremental refreshes, which resume from the newest stored bucket. Returns how
+        # many daily totals changed.
+        rows = []
+        for (window_start, _), window_rows in zip(windows, results):
+            if window_rows is None:
+                REFRESH_FAILURES.labels(org=self.name).inc()
+                logger.warning(f"Backfill stopped at window starting {window_start}; later windows are retried next refresh")
+                break
+            rows.extend(window_rows)
+        rows.sort(key=lambda row: row[0])
+        changed = self.store.upsert_buckets(rows, int(self.clock()))
+        self._apply_rows(rows)
+        return changed
+
+    def _apply_rows(self, rows):
+        # Folds freshly stored buckets (oldest first, contiguous days) into the breakdown,
+        # forecast, budget totals and anomaly statistics
+        today_start = int(self.clock()) // 86400 * 86400
+        for start_t, end_t, amount, items in rows:
+            if end_t <= today_start:
+                self.forecaster.update(start_t // 86400, amount)
+        self._observe_settled()
+        if rows:
+            self.budgets.update_days(rows, self.clock())
+            self.breakdown.replace_days(rows[0][0], rows[-1][0], [
+                (start_t, project_id, line_item, value * 100)
+                for start_t, _, _, items in rows for project_id, line_item, value in items
+            ])
+
+    def _catch_up_columns(self, fetched_at):
+        # Applies only the days the leader stored since we last looked; the whole history is
+        # re-read just once, if the store was empty when this process started
+        since = None
+        if self._columns_fetched_at is not None:
+            since = self.store.first_fetched_since(self._columns_fetched_at)
+        if since is None:
+            if self._columns_fetched_at is None:
+                self._load_columns()
+            self._columns_fetched_at = fetched_at
+            return
+        items = {}
+        for start_t, project_id, line_item, cents in self.store.iter_line_items(since):
+            items.setdefault(start_t, []).append((project_id, line_item, cents / 100))
+        self._apply_rows([(start_t, start_t + 86400, amount, items.get(start_t, []))
+                          for start_t, amount in self.store.daily_series(since=since)])
+        # Re-read from this stamp next time (>=), so buckets written within the same second are not missed
+        self._columns_fetched_at = fetched_at
+
+    def _observe_settled(self):
+        # Each day is scored once, when it leaves the settle window: before that its bucket
+        # is still filling up and a spike would be scored on a fraction of its final value
+        settled_before = self._settled_before()
+        last = self.anomalies.last_key("total")
+        since = last + 1 if last is not None else settled_before - self.anomaly_warmup_days * 86400
+        found = self._observe_days(self.anomalies, since, settled_before, self.clock())
+        # After downtime several days settle at once; only alert on the newest
+        self._hold_anomalies(found, since=settled_before - 86400)
+
+    def _observe_intraday(self):
+        # Scores usage buckets that closed since the last refresh, catching a spike within the hour
+        width = BUCKET_SECONDS[self.intraday_bucket]
+        now = int(self.clock())
+        after = self.anomalies.last_key("intraday") or 0
+        found = [self.anomalies.observe("intraday", start, cost, now)
+                 for start, cost in self.burn_window.closed_buckets(after, now, width)]
+        self._hold_anomalies([anomaly for anomaly in found if anomaly], since=0)
+
+    def _hold_anomalies(self, anomalies, since):
+        # Any refresh may score buckets, but only the scheduled check sends alerts: anomalies
+        # are held (newest per series) until then, or until the series may alert again, since
+        # a settled day is only ever scored once
+        if self.follower:
+            # Followers keep their statistics current for /api/anomalies; alerting is the leader's job
+            return
+        for anomaly in anomalies:
+            logger.warning(f"[{self.name}] Spend anomaly in {anomaly['series']}: ${anomaly['value']:.2f} "
+                           f"vs ~${anomaly['expected']:.2f} expected (z={anomaly['z']})")
+            if anomaly["key"] >= since:
+                self._held_anomalies[anomaly["series"]] = anomaly
+
+    def send_anomaly_alerts(self):
+        # A spike usually spans several buckets: each series alerts at most once per
+        # anomaly_throttle and never in quiet hours, tracked in the ledger like rule alerts
+        if not self._held_anomalies:
+            return
+        now = self.clock()
+        sent = self._load_ledger().get("anomaly_alerts", {})
+        for series, anomaly in list(self._held_anomalies.items()):
+            if not alert_allowed(sent.get(series, {}).get("ts", 0), now, self.anomaly_throttle, self.quiet_hours):
+                continue
+            self._held_anomalies.pop(series, None)
+            self.dispatcher.submit(self._build_anomaly_alert(anomaly))
+            self.ledger.record("anomaly_alert", series=series, key=anomaly["key"], value=anomaly["value"], ts=now)
+
+    def get_anomalies(self, limit=50):
+        # Newest first, plus the current statistics of every series
+        items = list(self.anomalies.recent)[-limit:]
+        return {"items": items[::-1], "series": self.anomalies.summary()}
+
+    def _fetch_window(self, window_start, window_end):
+        rows = []
+        query_start = window_start
+        try:
+            while query_start is not None and query_start < window_end:
+                # Retries (including 429 + Retry-After) are bounded inside the client
+                data = self.client.get_json("organization/costs", self.api_key, params=self._costs_params(query_start, window_end))
+                page_rows, query_start = self._parse_page(data, query_start)
+                rows.extend(page_rows)
+                with self._state_lock:
+                    self._pages_fetched += 1
+        except UpstreamError as e:
+            logger.error(f"Failed to fetch costs: {e}")
+            return None
+        return rows
+
+    def backfill(self, start_time, end_time=None):
+        # Fetches [start_time, end_time) as concurrent windows and stores the buckets in order
+        if end_time is None:
+            end_time = int(self.clock()) // 86400 * 86400 + 86400
+        windows = self._backfill_windows(start_time, end_time)
+        self._start_progress(len(windows))
+
+        def fetch(window):
+            rows = self._fetch_window(*window)
+            self._window_done(rows)
+            return rows
+
+        if len(windows) <= 1:
+            results = [fetch(w) for w in windows]
+        else:
+            logger.info(f"Backfilling {len(windows)} windows with {self.backfill_workers} workers")
+            with ThreadPoolExecutor(max_workers=self.backfill_workers) as pool:
+                results = list(pool.map(fetch, windows))
+        with stage(self.name, "merge"):
+            return self._merge_windows(windows, results)
 
     def get_aggregated_costs(self):
         if not self.api_key:
-            logger.warning("OPENAI_ADMIN_KEY not set. Cannot fetch costs.")
+            logger.warning(f"[{self.name}] No admin API key configured. Cannot fetch costs.")
+            self._fetch_error = "No admin API key configured"
             return {"total": 0.0, "daily": 0.0, "monthly": 0.0, "history": []}
 
-        ledger = self._load_ledger()
-        # Retrieve state
-        current_query_start = ledger.get("start_date", int(time.time()) - 86400)
-        historical_spend = ledger.get("historical_spend", 0.0)
-        monthly_history = ledger.get("monthly_history", {})
-        
-        url = "https://api.openai.com/v1/organization/costs"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        
-        new_spend_ephemeral = 0.0
-        new_spend_finalized = 0.0
-        daily_spend = 0.0
-        monthly_spend = 0.0
-        
-        now_utc = datetime.utcnow()
-        today_str = now_utc.strftime('%Y-%m-%d')
-        current_month_str = now_utc.strftime('%Y-%m')
-        
-        # We only 'finalize' costs that are older than the current month
-        checkpoint_ts = int(datetime(now_utc.year, now_utc.month, 1).timestamp())
+        started, pages = time.perf_counter(), self._pages_fetched
+        with stage(self.name, "plan"):
+            ledger, query_start = self._plan_fetch()
+        # A steady-state refresh is a single window; a cold start fans out
+        with stage(self.name, "backfill"):
+            changed = self.backfill(query_start)
+        self._record_fetch()
+        with stage(self.name, "aggregate"):
+            costs = self._aggregate(ledger, changed)
+        self._observe_fetch(started, pages)
+        return costs
 
-        has_more = True
-        loop_count = 0
-        max_loops = 100 
-        
-        last_processed_time = current_query_start
+    def _aggregate(self, ledger, changed):
+        # With no bucket changed, the same UTC day and the same ledger baseline, the totals
+        # are those of the previous refresh, so the store is not re-scanned
+        now_utc = datetime.utcfromtimestamp(self.clock())
+        key = (now_utc.strftime('%Y-%m-%d'), ledger.get("start_date"), ledger.get("historical_spend"),
+               tuple(sorted(ledger.get("monthly_history", {}).items())))
+        if not changed and key == self._aggregate_key and self._snapshot_costs is not None:
+            return self._snapshot_costs
+        costs = self._costs_from_store(ledger, now_utc)
+        self._aggregate_key = key
+        return costs
 
-        while has_more and loop_count < max_loops:
-            params = {
-                "start_time": int(current_query_start), 
-                "bucket_width": "1d", 
-                "limit": 100
-            }
+    def _record_fetch(self):
+        # as_of only moves forward when every window arrived; a partial fetch publishes its error
+        failed = self.progress["windows_failed"]
+        if failed:
+            self._fetch_error = f"{failed} of {self.progress['windows_total']} cost windows failed"
+        else:
+            self._fetch_error = None
+            self._fetched_ok_at = self.clock()
 
-            try:
-                response = requests.get(url, headers=headers, params=params)
-                if response.status_code == 429:
-                    time.sleep(2)
-                    continue
-                
-                response.raise_for_status()
-                data = response.json()
-                buckets = data.get("data", [])
-                
-                if not buckets:
-                    has_more = False
-                    break
-                    
-                last_bucket_end = current_query_start
-
-                for bucket in buckets:
-                    start_t = bucket.get("start_time")
-                    end_t = bucket.get("end_time")
-                    
-                    if end_t and end_t > last_bucket_end:
-                        last_bucket_end = end_t
-                    
-                    bucket_date_str = None
-                    bucket_month_display = None
-                    
-                    if start_t:
-                        dt = datetime.utcfromtimestamp(start_t)
-                        bucket_date_str = dt.strftime('%Y-%m-%d')
-                        bucket_month_display = dt.strftime('%b %Y')
-
-                    bucket_spend = 0.0
-                    for result in bucket.get("results", []):
-                        val = result.get("amount", {}).get("value", 0.0)
-                        bucket_spend += float(val)
-                    
-                    # Update Monthly History Map (Accumulate)
-                    if bucket_month_display:
-                        # If finalized (older than current month), save to ledger map permanently later
-                        # If ephemeral (current month), we just add it to a temporary display copy?
-                        # Actually, since we only save ledger if we finalize, we can update the map here safely.
-                        # The map in memory starts with what was in ledger.
-                        monthly_history[bucket_month_display] = monthly_history.get(bucket_month_display, 0.0) + bucket_spend
-
-                    # Core Logic: If bucket is older than current month, finalize it
-                    if end_t and end_t <= checkpoint_ts:
-                        new_spend_finalized += bucket_spend
-                        if end_t > last_processed_time:
-                            last_processed_time = end_t
-                    else:
-                        new_spend_ephemeral += bucket_spend
-
-                    if bucket_date_str:
-                        if bucket_date_str == today_str:
-                            daily_spend += bucket_spend
-                        if bucket_date_str.startswith(current_month_str):
-                            monthly_spend += bucket_spend
-                
-                if len(buckets) < 100:
-                    has_more = False
-                else:
-                    if last_bucket_end <= current_query_start:
-                         current_query_start += 86400
-                    else:
-                        current_query_start = last_bucket_end
-                
-                loop_count += 1
-                time.sleep(0.05)
+    def _fetch_errors(self):
+        errors = [self._fetch_error] if self._fetch_error else []
+        if self._intraday_failed:
+            errors.append("intraday usage fetch failed")
+        return "; ".join(errors) or None
 
-            except Exception as e:
-                logger.error(f"Failed to fetch costs: {e}")
-                has_more = False
-
-        # Persist finalized history
-        if new_spend_finalized > 0 or last_processed_time > ledger.get("start_date", 0):
-            ledger["historical_spend"] = historical_spend + new_spend_finalized
-            ledger["start_date"] = int(last_processed_time)
-            # IMPORTANT: We save the monthly_history back to ledger. 
-            # Note: This contains EVERYTHING (old banked + new finalized + new ephemeral).
-            # We should technically only save the finalized parts to avoid "drift" if we crash?
-            # Actually, saving ephemeral parts is harmless because next time we load, we might double count?
-            # YES. If we save ephemeral 'Dec 2025'=$10 now.
-            # Next time, we load 'Dec 2025'=$10.
-            # Then we re-fetch 'Dec 2025' (because start_date is Nov 30). We get $10.
-            # We add it: $10 + $10 = $20. DOUBLE COUNT.
-            
-            # FIX: We must NOT save ephemeral months to the ledger!
-            # We need to filter `monthly_history` before saving.
-            
-            # Create a clean map for saving (only finalized months)
-            # We know finalized months are anything BEFORE current_month_str? 
-            # Or roughly based on checkpoint.
-            
-            map_to_save = {}
-            current_display = now_utc.strftime('%b %Y')
-            
-            for k, v in monthly_history.items():
-                if k != current_display:
-                    map_to_save[k] = v
-            
-            ledger["monthly_history"] = map_to_save
-            self._save_ledger(ledger)
-            logger.info(f"Banked ${new_spend_finalized:.2f} into history. New start_date: {ledger['start_date']}")
+    def _observe_fetch(self, started, pages):
+        COST_FETCH_SECONDS.labels(org=self.name).observe(time.perf_counter() - started)
+        COST_PAGES.labels(org=self.name).observe(self._pages_fetched - pages)
 
-        total_accumulated = ledger["historical_spend"] + new_spend_ephemeral
-        
-        history_list = [{"month": k, "amount": v} for k, v in monthly_history.items()]
-        # Sort by month
-        try:
-            history_list.sort(key=lambda x: datetime.strptime(x["month"], "%b %Y"), reverse=True)
-        except:
-            pass
+    def _costs_from_store(self, ledger, now_utc):
+        baseline_cutoff = ledger.get("start_date", 0)
+        today_str = now_utc.strftime('%Y-%m-%d')
+        month_start_str = now_utc.strftime('%Y-%m-01')
+
+        total = ledger.get("historical_spend", 0.0) + self.store.total(since=baseline_cutoff)
+        daily_spend = self.store.range_total(today_str, today_str, since=baseline_cutoff)
+        monthly_spend = self.store.range_total(month_start_str, today_str, since=baseline_cutoff)
+
+        # Keyed by 'YYYY-MM' so the list sorts lexically; the banked baseline uses '%b %Y'
+        months = {}
+        for display, amount in ledger.get("monthly_history", {}).items():
+            try:
+                key = datetime.strptime(display, '%b %Y').strftime('%Y-%m')
+            except ValueError:
+                continue
+            months[key] = months.get(key, 0.0) + amount
+        for key, amount in self.store.monthly_totals(since=baseline_cutoff).items():
+            months[key] = months.get(key, 0.0) + amount
+
+        # Newest first, sorted once per refresh
+        history_list = [
+            {"month": datetime.strptime(key, '%Y-%m').strftime('%b %Y'), "key": key, "amount": months[key]}
+            for key in sorted(months, reverse=True)
+        ]
 
         return {
-            "total": total_accumulated,
+            "total": total,
             "daily": daily_spend,
             "monthly": monthly_spend,
             "history": history_list
         }
 
-    def get_balance(self):
+    def _usage_params(self, start, page=None):
+        params = {
+            "start_time": int(start),
+            "bucket_width": self.intraday_bucket,
+            "group_by": ["model"],
+            "limit": PAGE_LIMITS[self.intraday_bucket]
+        }
+        if page:
+            params["page"] = page
+        return params
+
+    def _usage_start(self, endpoint):
+        # Resume at the newest bucket seen (it was still filling up); cold start covers
+        # today plus the burn-rate window
+        start = self._usage_cursor.get(endpoint)
+        if start is None:
+            now = int(self.clock())
+            start = min(now - self.burn_window.window_seconds, now // 86400 * 86400)
+        return start
+
+    def _ingest_usage_page(self, endpoint, data):
+        # Returns the cursor for the next page, or None when done
+        for bucket in data.get("data", []):
+            start_t = bucket.get("start_time")
+            if not start_t:
+                continue
+            cost = sum(self.prices.estimate(result) for result in bucket.get("results", []))
+            self.burn_window.set(start_t, endpoint, cost)
+            self._usage_cursor[endpoint] = max(self._usage_cursor.get(endpoint, 0), start_t)
+        return data.get("next_page") if data.get("has_more") else None
+
+    def refresh_intraday(self):
+        if not self.api_key:
+            return
+        self._intraday_failed = False
+        with stage(self.name, "intraday"):
+            for endpoint in USAGE_ENDPOINTS:
+                start, page = self._usage_start(endpoint), None
+                while True:
+                    try:
+                        data = self.client.get_json(f"organization/usage/{endpoint}", self.api_key,
+                                                    params=self._usage_params(start, page))
+                    except UpstreamError as e:
+                        logger.error(f"[{self.name}] Failed to fetch {endpoint} usage: {e}")
+                        self._intraday_failed = True
+                        break
+                    page = self._ingest_usage_page(endpoint, data)
+                    if not page:
+                        break
+            self.burn_window.prune(int(self.clock()))
+            self._observe_intraday()
+
+    def _intraday_summary(self, costs, balance):
+        # Usage estimated for today beyond what the (lagging) daily cost bucket already
+        # shows is treated as spent but not yet settled
+        now = int(self.clock())
+        estimated_today = self.burn_window.spend_between(now // 86400 * 86400, now + 86400)
+        unsettled = max(0.0, estimated_today - costs["daily"])
+        return {
+            "burn_rate_per_hour": round(self.burn_window.rate_per_hour(now), 4),
+            "intraday_estimate": round(estimated_today, 2),
+            "projected_balance": round(balance - unsettled, 2),
+        }
+
+    def _publish(self, costs):
         ledger = self._load_ledger()
-        costs = self.get_aggregated_costs()
         spend = costs["total"]
         balance = ledger["total_deposited"] - spend
-        return {
+        status = {
             "balance": round(balance, 2),
             "total_deposited": ledger["total_deposited"],
             "total_spend": round(spend, 2),
             "daily_usage": round(costs["daily"], 2),
             "monthly_usage": round(costs["monthly"], 2),
-            "history": costs["history"],
-            "currency": "USD"
+            "currency": "USD",
+            "threshold": self.threshold,
         }
+        status.update(self._intraday_summary(costs, balance))
+        status["error"] = self._fetch_errors()
+        status["warming"] = self.warming
+        with self._state_lock:
+            # The revision (and so the ETag) only moves when the payload does; a refresh that
+            # fetched the same numbers leaves pollers holding a valid tag
+            previous = self._snapshot
+            if (previous is None or costs != self._snapshot_costs
+                    or any(previous.get(key) != value for key, value in status.items())):
+                self._revision += 1
+                self._changed_at = int(self.clock())
+            status["revision"] = self._revision
+            status["changed_at"] = self._changed_at
+            # as_of is when costs were last fetched completely, so a failing upstream shows as stale;
+            # refreshed_at is the last attempt, which paces read-triggered refreshes
+            status["as_of"] = int(self._fetched_ok_at or 0)
+            status["refreshed_at"] = int(self.clock())
+            self._snapshot_costs = costs
+            # Ascending month keys for range lookups over the (descending) history list
+            self._history_keys = [row["key"] for row in reversed(costs["history"])]
+            self._snapshot = status
+        # Only the leader writes the shared snapshot; a follower's local publish (e.g. after a
+        # deposit) is superseded by the leader's next one
+        if not self.follower:
+            self._persist_snapshot(status, costs)
+        self._notify(status)
+        return dict(status)
 
-    def check_and_alert(self):
-        status = self.get_balance()
-        balance = status["balance"]
+    def _notify(self, status):
+        for listener in self.listeners:
+            try:
+                listener(self, dict(status))
+            except Exception as e:
+                logger.error(f"[{self.name}] Snapshot listener failed: {e}")
+
+    def refresh(self):
+        # Single-flight: callers queued behind an in-flight fetch reuse its result
+        # instead of starting another crawl of the Costs API.
+        if self.follower:
+            if self._follow_due():
+                self._follow()
+            return self._followed_status()
+        generation = self._fetch_generation
+        with self._refresh_lock:
+            if self._fetch_generation != generation and self._snapshot is not None:
+                return dict(self._snapshot)
+            costs = self.get_aggregated_costs()
+            self._fetch_generation += 1
+            self.warming = False
+            with stage(self.name, "publish"):
+                return self._publish(costs)
+
+    def _max_age(self):
+        # Reads must not out-poll the scheduler: while it is checking rarely, the snapshot
+        # stays fresh for up to two of its intervals
+        return max(self.max_staleness, 2 * self.poller.interval)
+
+    def get_status(self, max_age=None):
+        if max_age is None:
+            max_age = self._max_age()
+        snapshot = self._snapshot
+        if self.follower or snapshot is None or self.clock() - snapshot.get("refreshed_at", snapshot["as_of"]) > max_age:
+            snapshot = self.refresh()
+        status = dict(snapshot)
+        status["stale"] = self.clock() - status["as_of"] > max_age
+        return status
+
+    def _start_progress(self, windows):
+        self.progress.update(windows_total=windows, windows_done=0, windows_failed=0)
+
+    def _window_done(self, rows):
+        with self._state_lock:
+            self.progress["windows_done"] += 1
+            if rows is None:
+                self.progress["windows_failed"] += 1
+
+    def get_balance(self):
+        return self.refresh()
+
+    def get_breakdown(self, first_day, last_day, group_by=("project_id", "line_item"), top=None):
+        # Served from the local columnar copy; never calls the upstream API
+        result = self.breakdown.query(first_day, last_day, group_by, top)
+        result.update({"from": first_day, "to": last_day, "group_by": list(group_by), "currency": "USD"})
+        return result
+
+    def export_costs(self, first_day, last_day, group_by=()):
+        # Lazily yields stored daily rows for an inclusive day range; never calls the upstream API
+        if first_day > last_day:
+            raise ValueError("'from' must not be after 'to'")
+        since = day_number(first_day) * 86400
+        return self.store.iter_export(since, day_number(last_day) * 86400 + 86400, tuple(group_by))
+
+    def get_forecast(self, horizon=90):
+        # Projects the current snapshot's balance forward from today
+        if self._snapshot is None:
+            return {"available": False, "reason": "No balance snapshot yet"}
+        status = self._snapshot
+        result = self.forecaster.forecast(
+            balance=status["total_deposited"] - self._snapshot_costs["total"],
+            threshold=self.threshold,
+            start_day=int(self.clock()) // 86400,
+            horizon=horizon,
+            spent_today=self._snapshot_costs["daily"],
+        )
+        result.update({"balance": status["balance"], "threshold": self.threshold, "as_of": status["as_of"]})
+        return result
+
+    def get_history(self, from_month=None, to_month=None, limit=None, offset=0):
+        # Months are 'YYYY-MM', both ends inclusive; rows come back newest first
+        history = self._snapshot_costs["history"] if self._snapshot_costs else []
+        keys = self._history_keys if self._snapshot_costs else []
+        lo = bisect.bisect_left(keys, from_month) if from_month else 0
+        hi = bisect.bisect_right(keys, to_month) if to_month else len(keys)
+        start, end = len(keys) - hi, len(keys) - lo
+        rows = history[start:end][offset:]
+        if limit is not None:
+            rows = rows[:limit]
+        return {"items": rows, "total": max(end - start, 0)}
+
+    def _alert_due(self, balance):
+        # Returns the ledger when an alert should go out now, otherwise None. Callers pass
+        # the projected balance so unsettled intraday spend counts too.
         ledger = self._load_ledger()
-        logger.info(f"Current Balance Check: ${balance}. Threshold: ${self.threshold}")
+        logger.info(f"[{self.name}] Current Balance Check: ${balance} (projected). Threshold: ${self.threshold}")
         if balance < self.threshold:
-            last_sent = ledger.get("last_alert_sent", 0)
-            # Alert every 2 hours (7200 seconds)
-            if (time.time() - last_sent) > 7200:
-                # Quiet hours check (9 PM to 6 AM)
-                current_hour = datetime.now().hour
-                if 6 <= current_hour < 21:
-                    self.send_email_alert(balance)
-                    ledger["last_alert_sent"] = time.time()
-                    self._save_ledger(ledger)
-                else:
-                    logger.info("Skipping alert due to quiet hours (9PM - 6AM)")
+            if alert_allowed(ledger.get("last_alert_sent", 0), self.clock(), self.alert_throttle, self.quiet_hours):
+                return ledger
+            logger.info(f"[{self.name}] Skipping alert (sent within {self.alert_throttle:.0f}s or quiet hours)")
+        return None
+
+    def _mark_alert_sent(self, ledger):
+        self.ledger.record("alert_sent", ts=self.clock())
+
+    def check_and_alert(self):
+        if self.follower:
+            # Checks and alerts are the leader's job
+            return self.refresh()
+        try:
+            self.refresh_intraday()
+            status = self.get_balance()
+        except Exception:
+            self.poller.record_failure(self.clock())
+            raise
+        self._schedule_next(status)
+        self._raise_alerts(status)
         return status
 
-    def send_email_alert(self, balance):
-        if not self.smtp_user or not self.smtp_pass:
-            logger.warning("SMTP credentials not set. Skipping email alert.")
-            return
+    def _raise_alerts(self, status):
+        # Rules are only evaluated here, on the leader's scheduled check: any other refresh
+        # (a dashboard read, the recharge CLI) must not consume a rule's or a series' throttle
+        self.check_budgets()
+        self.send_anomaly_alerts()
+        ledger = self._alert_due(status["projected_balance"])
+        if ledger is not None:
+            self.queue_alert(status["projected_balance"])
+            self._mark_alert_sent(ledger)
 
-        msg = EmailMessage()
-        msg["Subject"] = f"ACTION REQUIRED: OpenAI Credit Balance Critical (${balance:.2f})"
-        msg["From"] = self.smtp_user
-        msg["To"] = self.recipient_email
+    def check_if_due(self):
+        if not self.poller.due(self.clock()):
+            return None
+        return self.check_and_alert()
+
+    def _schedule_next(self, status):
+        # Upstream errors back off; otherwise the next check is planned from headroom over
+        # the burn rate (intraday usage, or the recent daily average when usage is idle)
+        now = self.clock()
+        if self._intraday_failed or self.progress["windows_failed"]:
+            delay = self.poller.record_failure(now)
+        else:
+            burn = max(status["burn_rate_per_hour"], self.forecaster.mean_daily() / 24)
+            delay = self.poller.record_success(status["projected_balance"] - self.threshold, burn, now)
+        logger.info(f"[{self.name}] Next check in {delay:.0f}s")
+
+    def check_budgets(self):
+        # Runs on every scheduled check; cost is O(rules) since the totals are maintained incrementally
+        # Periods that ended within the settle window are checked too, since their last buckets
+        # land after midnight; each of those alerts at most once
+        breaches = self.budgets.evaluate(self.clock(), self.settle_days)
+        if not breaches:
+            return []
+        now = self.clock()
+        sent = self._load_ledger().get("rule_alerts", {})
+        queued = []
+        for breach in breaches:
+            rule = breach["rule"]
+            last = sent.get(rule.name, {})
+            last_sent = last.get("periods", {}).get(breach["period"])
+            if last.get("period") == breach["period"]:
+                last_sent = last["ts"]
+            if last_sent is not None and not breach["current"]:
+                continue
+            if not alert_allowed(last_sent or 0, now, rule.throttle_seconds, rule.quiet_hours):
+                continue
+            logger.info(f"[{self.name}] Budget rule '{rule.name}' breached: {breach['value']:.4g} > {rule.limit:.4g}")
+            self.dispatcher.submit(self._build_rule_alert(breach))
+            self.ledger.record("rule_alert", rule=rule.name, period=breach["period"], value=breach["value"], ts=now)
+            queued.append(rule.name)
+        return queued
+
+    def get_budgets(self):
+        sent = self._load_ledger().get("rule_alerts", {})
+        return {"rules": [{
+            "name": result["rule"].name,
+            "description": result["rule"].describe(),
+            "period": result["period"],
+            "value": round(result["value"], 4),
+            "spend": round(result["spend"], 2),
+            "limit": result["rule"].limit,
+            "breached": result["breached"],
+            "last_alert": sent.get(result["rule"].name),
+        } for result in self.budgets.values(self.clock())]}
+
+    def _build_rule_alert(self, breach):
+        rule = breach["rule"]
+        shown = f"{breach['value']:.1%}" if rule.metric == "share" else f"${breach['value']:.2f}"
+        limit = f"{rule.limit:.0%}" if rule.metric == "share" else f"${rule.limit:.2f}"
+        subject = f"Budget rule '{rule.name}' exceeded: {shown} (limit {limit})"
+        if not breach.get("current", True):
+            subject += f" on {breach['period']}"
+        if self.name != "default":
+            subject += f" [{self.name}]"
+        recipients = rule.recipients or self.recipient_email or ""
+        if isinstance(recipients, str):
+            recipients = [r.strip() for r in recipients.split(",") if r.strip()]
+        return {
+            "org": self.name,
+            "balance": self._snapshot["balance"] if self._snapshot else None,
+            "threshold": rule.limit,
+            "rule": rule.name,
+            "value": round(breach["value"], 4),
+            "recipients": recipients,
+            "subject": subject,
+            "text": f"{rule.describe()}: {shown} for {breach['period']}.",
+            "created_at": int(self.clock()),
+        }
+
+    def _build_anomaly_alert(self, anomaly):
+        when = datetime.utcfromtimestamp(anomaly["key"]).strftime('%Y-%m-%d %H:%M UTC')
+        subject = f"Spend anomaly: ${anomaly['value']:.2f} in {anomaly['series']} (usually ~${anomaly['expected']:.2f})"
+        if self.name != "default":
+            subject += f" [{self.name}]"
+        return {
+            "org": self.name,
+            "balance": self._snapshot["balance"] if self._snapshot else None,
+            "threshold": anomaly["expected"],
+            "rule": f"anomaly:{anomaly['series']}",
+            "value": anomaly["value"],
+            "recipients": [r.strip() for r in (self.recipient_email or "").split(",") if r.strip()],
+            "subject": subject,
+            "text": f"Spend of ${anomaly['value']:.2f} in the {anomaly['series']} bucket starting {when} is "
+                    f"{anomaly['z']} standard deviations above its recent average of ${anomaly['expected']:.2f}.",
+            "created_at": int(self.clock()),
+        }
+
+    def queue_alert(self, balance):
+        # Hands the alert to the dispatcher and returns immediately; delivery results
+        # end up in self.dispatcher.results
+        return self.dispatcher.submit(self._build_alert(balance))
+
+    def _build_alert(self, balance):
+        subject = f"ACTION REQUIRED: OpenAI Credit Balance Critical (${balance:.2f})"
+        if self.name != "default":
+            subject += f" [{self.name}]"
+        recipients = [r.strip() for r in (self.recipient_email or "").split(",") if r.strip()]
+        text = (
+            f"The available prepaid credit balance for the organization has dropped below the configured safety threshold.\n\n"
+            f"Current Balance: ${balance:.2f}\n"
+            f"Alert Threshold: ${self.threshold:.2f}\n\n"
+            f"Please recharge the OpenAI account: https://platform.openai.com/settings/organization/billing/overview"
+        )
 
         # Professional HTML Template
         html_content = f"""
@@ -326,7 +970,7 @@ class OpenAIMonitor:
                   </tr>
                   <tr style="background-color: #f9f9f9;">
                     <td style="padding: 10px; border: 1px solid #ddd;"><strong>Timestamp:</strong></td>
-                    <td style="padding: 10px; border: 1px solid #ddd;">{datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</td>
+                    <td style="padding: 10px; border: 1px solid #ddd;">{datetime.utcfromtimestamp(self.clock()).strftime('%Y-%m-%d %H:%M:%S UTC')}</td>
                   </tr>
                 </table>
 
@@ -338,33 +982,21 @@ class OpenAIMonitor:
                 </div>
               </div>
               <div style="background-color: #f5f5f5; padding: 15px; text-align: center; font-size: 12px; color: #777;">
-                <p>&copy; {datetime.now().year} Darwix AI Automation. All rights reserved.</p>
+                <p>&copy; {datetime.utcfromtimestamp(self.clock()).year} Darwix AI Automation. All rights reserved.</p>
                 <p>This is an automated system message. Please do not reply directly to this email.</p>
               </div>
             </div>
           </body>
         </html>
         """
-        
-        msg.add_alternative(html_content, subtype='html')
 
-        try:
-            logger.info(f"Connecting to SMTP server {self.smtp_server}:{self.smtp_port}...")
-            
-            if self.smtp_port == 465:
-                # Use SMTP_SSL for port 465
-                with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
-                    server.login(self.smtp_user, self.smtp_pass)
-                    server.send_message(msg)
-            else:
-                # Use standard SMTP + STARTTLS for 587 or others
-                with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                    server.ehlo()
-                    server.starttls()
-                    server.ehlo()
-                    server.login(self.smtp_user, self.smtp_pass)
-                    server.send_message(msg)
-            
-            logger.info(f"Alert email sent to recipients: {self.recipient_email}")
-        except Exception as e:
-            logger.error(f"Failed to send email: {e}")
+        return {
+            "org": self.name,
+            "balance": round(balance, 2),
+            "threshold": self.threshold,
+            "recipients": recipients,
+            "subject": subject,
+            "text": text,
+            "html": html_content,
+            "created_at": int(self.clock()),
+        }
@@ -0,0 +1,246 @@
+import os
+import time
+import queue
+import random
+import smtplib
+import threading
+import logging
+from collections import deque
+from email.message import EmailMessage
+
+import requests
+from urllib.parse import urlparse
+
+from metrics import SMTP_SECONDS, SMTP_FAILURES, ALERT_DELIVERIES
+
+logger = logging.getLogger("OpenAIMonitor")
+
+_STOP = object()
+
+
+class EmailChannel:
+    """Delivers alerts over one SMTP connection that is kept open between sends.
+
+    The connection is opened on the first alert and never closed for being idle;
+    if the server has dropped it by the next send, it is reopened then.
+
+    Each alert goes out as a single message whose envelope carries up to
+    `batch_size` recipients, so a long recipient list costs a few DATA commands
+    rather than one connection per address.
+    """
+
+    name = "email"
+
+    def __init__(self, server, port, user, password, starttls=True, batch_size=50, timeout=30):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._smtp = None
+
+    def _connect(self):
+        logger.info(f"Connecting to SMTP server {self.server}:{self.port}...")
+        if self.port == 465:
+            smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+        smtp.login(self.user, self.password)
+        return smtp
+
+    def send(self, alert):
+        recipients = alert["recipients"]
+        if not recipients:
+            raise ValueError("no recipients configured")
+        msg = EmailMessage()
+        msg["Subject"] = alert["subject"]
+        msg["From"] = self.user
+        msg["To"] = ", ".join(recipients)
+        msg.set_content(alert["text"])
+        if alert.get("html"):
+            msg.add_alternative(alert["html"], subtype="html")
+
+        started = time.perf_counter()
+        for i in range(0, len(recipients), self.batch_size):
+            batch = recipients[i:i + self.batch_size]
+            try:
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                self._smtp.send_message(msg, from_addr=self.user, to_addrs=batch)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self._reconnect(msg, batch, e)
+            except smtplib.SMTPResponseException as e:
+                # 421: the server is closing an idle session
+                if e.smtp_code != 421:
+                    self.close()
+                    raise
+                self._reconnect(msg, batch, e)
+            except Exception:
+                self.close()
+                raise
+        SMTP_SECONDS.observe(time.perf_counter() - started)
+        logger.info(f"Alert email sent to recipients: {', '.join(recipients)}")
+
+    def _reconnect(self, msg, batch, error):
+        # The server dropped the idle connection; reconnect once and resend this batch
+        logger.info(f"SMTP connection lost ({error}); reconnecting")
+        self.close()
+        try:
+            self._smtp = self._connect()
+            self._smtp.send_message(msg, from_addr=self.user, to_addrs=batch)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class WebhookChannel:
+    """POSTs each alert as JSON to a URL, e.g. a chat or incident-management webhook."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        # Webhook URLs often embed a secret token, so only the host is used in logs and results
+        self.name = f"webhook:{urlparse(url).netloc}"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, alert):
+        keys = ("org", "balance", "threshold", "rule", "value", "subject", "text", "created_at")
+        payload = {key: alert[key] for key in keys if key in alert}
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class AlertDispatcher:
+    """Delivers queued alerts to every channel on a background thread.
+
+    `submit` never blocks: the queue is bounded and an alert that does not fit is
+    dropped and recorded. Failed deliveries are retried with full-jitter backoff,
+    and the outcome of each (alert, channel) pair is kept in `results`.
+    """
+
+    def __init__(self, channels, maxsize=100, max_attempts=5, backoff_base=2.0, backoff_cap=60.0,
+                 history=200):
+        self.channels = channels
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.results = deque(maxlen=history)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    @classmethod
+    def from_env(cls):
+        channels = []
+        smtp_user, smtp_pass = os.getenv("SMTP_EMAIL"), os.getenv("SMTP_PASSWORD")
+        if smtp_user and smtp_pass:
+            channels.append(EmailChannel(
+                server=os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+                port=int(os.getenv("SMTP_PORT", 587)),
+                user=smtp_user,
+                password=smtp_pass,
+                starttls=os.getenv("SMTP_STARTTLS", "true").lower() != "false",
+                batch_size=int(os.getenv("SMTP_BATCH_SIZE", 50)),
+            ))
+            logger.info(f"SMTP Config: {channels[0].server}:{channels[0].port} (User: {smtp_user})")
+        else:
+            logger.warning("SMTP credentials not set. Email alerts are disabled.")
+        for url in filter(None, (u.strip() for u in os.getenv("ALERT_WEBHOOK_URLS", "").split(","))):
+            channels.append(WebhookChannel(url, timeout=float(os.getenv("ALERT_WEBHOOK_TIMEOUT", 10))))
+        return cls(
+            channels,
+            maxsize=int(os.getenv("ALERT_QUEUE_SIZE", 100)),
+            max_attempts=int(os.getenv("ALERT_MAX_ATTEMPTS", 5)),
+        )
+
+    def submit(self, alert):
+        # Returns the alert id, or None when the queue was full and the alert dropped
+        with self._lock:
+            self._next_id += 1
+            alert = dict(alert, id=self._next_id, queued_at=time.time())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            logger.error(f"[{alert['org']}] Alert queue full; dropping alert {alert['id']}")
+            ALERT_DELIVERIES.labels(channel="queue", outcome="dropped").inc()
+            self._record(alert, "queue", False, 0, "queue full")
+            return None
+        return alert["id"]
+
+    def _record(self, alert, channel, ok, attempts, error=None):
+        self.results.append({
+            "id": alert["id"],
+            "org": alert["org"],
+            "channel": channel,
+            "ok": ok,
+            "attempts": attempts,
+            "error": error,
+            "queued_at": alert["queued_at"],
+            "finished_at": time.time(),
+        })
+
+    def _deliver(self, channel, alert):
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                channel.send(alert)
+                ALERT_DELIVERIES.labels(channel=channel.name, outcome="delivered").inc()
+                self._record(alert, channel.name, True, attempt + 1)
+                return
+            except Exception as e:
+                error = str(e)
+                if isinstance(channel, EmailChannel):
+                    SMTP_FAILURES.inc()
+                logger.error(f"[{alert['org']}] {channel.name} delivery failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < self.max_attempts:
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+                if self._stop.wait(delay):
+                    break
+        ALERT_DELIVERIES.labels(channel=channel.name, outcome="failed").inc()
+        self._record(alert, channel.name, False, attempt + 1, error)
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            if alert is _STOP:
+                break
+            for channel in self.channels:
+                self._deliver(channel, alert)
+        for channel in self.channels:
+            channel.close()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=10):
+        # Delivers what is already queued (without further retry waits), then stops
+        if self._thread is None:
+            return
+        self._stop.set()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
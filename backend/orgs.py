@@ -0,0 +1,172 @@
+import os
+import json
+import asyncio
+import logging
+
+from async_monitor import AsyncOpenAIMonitor
+from http_client import AsyncApiClient
+from notifications import AlertDispatcher
+
+logger = logging.getLogger("OpenAIMonitor")
+
+
+def load_org_configs(path=None):
+    # ORGS_CONFIG points to a JSON file: {"orgs": [{"name": ..., "api_key_env": ..., ...}]}.
+    # Without it the service watches a single "default" org configured from the environment.
+    path = path or os.getenv("ORGS_CONFIG")
+    if not path:
+        return [{"name": "default"}]
+    with open(path, "r") as f:
+        data = json.load(f)
+    orgs = data.get("orgs", [])
+    if not orgs:
+        raise ValueError(f"No orgs defined in {path}")
+    names = [org["name"] for org in orgs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate org names in {path}")
+    return orgs
+
+
+class OrgRegistry:
+    """One monitor per org, sharing a single pooled upstream client.
+
+    Refreshes fan out concurrently but never more than `concurrency` orgs at a
+    time; the client's token bucket caps the combined request rate.
+    """
+
+    def __init__(self, configs, client=None, concurrency=None, dispatcher=None, follower=False):
+        self.client = client or AsyncApiClient.from_env()
+        # One alert queue and SMTP connection for every org
+        self.dispatcher = dispatcher or AlertDispatcher.from_env()
+        self.concurrency = concurrency or int(os.getenv("ORG_CONCURRENCY", 4))
+        self.monitors = {}
+        for config in configs:
+            name = config["name"]
+            default = name == "default"
+            api_key = config.get("api_key")
+            if config.get("api_key_env"):
+                api_key = os.getenv(config["api_key_env"])
+                if not api_key:
+                    # The org is still listed, with its status reporting the missing key as an error
+                    logger.error(f"[{name}] {config['api_key_env']} is not set; this org will not be polled")
+            recipients = config.get("recipients")
+            if isinstance(recipients, list):
+                recipients = ", ".join(recipients)
+            self.monitors[name] = AsyncOpenAIMonitor(
+                ledger_file=config.get("ledger_file", "ledger.json" if default else f"ledger-{name}.json"),
+                store_file=config.get("store_file", None if default else f"costs-{name}.db"),
+                client=self.client,
+                name=name,
+                api_key=api_key,
+                threshold=config.get("threshold"),
+                recipient_email=recipients,
+                dispatcher=self.dispatcher,
+                follower=follower,
+            )
+        self.default = next(iter(self.monitors.values()))
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls, follower=False):
+        return cls(load_org_configs(), follower=follower)
+
+    def get(self, name):
+        return self.monitors.get(name)
+
+    async def _each(self, action):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(monitor):
+            async with self._semaphore:
+                try:
+                    return await action(monitor)
+                except Exception as e:
+                    # One org failing must not stop the others from refreshing
+                    logger.error(f"[{monitor.name}] {action.__name__} failed: {e}")
+                    return None
+
+        return await asyncio.gather(*(run(m) for m in self.monitors.values()))
+
+    async def check_all(self):
+        async def check_and_alert(monitor):
+            return await monitor.check_and_alert()
+        return await self._each(check_and_alert)
+
+    async def check_due(self):
+        # Scheduler tick: only orgs whose adaptive poll interval has elapsed are checked
+        async def check_if_due(monitor):
+            return await monitor.check_if_due()
+        return await self._each(check_if_due)
+
+    async def warm_up(self):
+        # Catches up every org and waits for all of them to finish
+        async def warm_up(monitor):
+            return await monitor.start_warm_up()
+        return await self._each(warm_up)
+
+    def start_warm_up(self):
+        # Schedules each org's catch-up and returns at once; statuses are served from restored
+        # snapshots meanwhile. A cold backfill can take far longer than the lease TTL, so the
+        # caller must never wait on it.
+        return [monitor.start_warm_up() for monitor in self.monitors.values()]
+
+    def set_role(self, follower):
+        for monitor in self.monitors.values():
+            monitor.set_follower(follower)
+
+    async def sync(self):
+        # Heartbeat while several workers share the files. Followers pick up the leader's
+        # latest snapshot (so their SSE clients get pushed deltas); the leader republishes
+        # when another worker recorded a deposit or sync in the shared ledger.
+        for monitor in self.monitors.values():
+            try:
+                if monitor.follower:
+                    await asyncio.to_thread(monitor._follow)
+                elif monitor._snapshot_costs is not None and await asyncio.to_thread(monitor.ledger.catch_up):
+                    await asyncio.to_thread(monitor._publish, monitor._snapshot_costs)
+            except Exception as e:
+                logger.error(f"[{monitor.name}] sync failed: {e}")
+
+    def progress(self):
+        return {name: dict(monitor.progress, warming=monitor.warming, poll=monitor.poller.state())
+                for name, monitor in self.monitors.items()}
+
+    async def overview(self):
+        async def get_status(monitor):
+            return await monitor.get_status()
+        statuses = await self._each(get_status)
+
+        orgs = []
+        for monitor, status in zip(self.monitors.values(), statuses):
+            if status is None:
+                orgs.append({"name": monitor.name, "error": True})
+                continue
+            orgs.append({
+                "name": monitor.name,
+                "balance": status["balance"],
+                "threshold": status["threshold"],
+                "daily_usage": status["daily_usage"],
+                "monthly_usage": status["monthly_usage"],
+                "low": status["balance"] < status["threshold"],
+                "stale": status["stale"],
+                "as_of": status["as_of"],
+            })
+        healthy = [org for org in orgs if not org.get("error")]
+        return {
+            "orgs": orgs,
+            "total_balance": round(sum(org["balance"] for org in healthy), 2),
+            "total_daily_usage": round(sum(org["daily_usage"] for org in healthy), 2),
+            "total_monthly_usage": round(sum(org["monthly_usage"] for org in healthy), 2),
+            "currency": "USD",
+        }
+
+    async def close(self):
+        for monitor in self.monitors.values():
+            if monitor._warm_up_task is not None:
+                monitor._warm_up_task.cancel()
+        await self.client.close()
+        await asyncio.to_thread(self.dispatcher.close)
+        for monitor in self.monitors.values():
+            monitor.store.close()
+            monitor.ledger.close()
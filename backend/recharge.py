@@ -1,16 +1,227 @@
+import csv
+import sys
 import argparse
+from datetime import datetime, timezone
+
+from ledger import OPERATIONS
 from monitor import OpenAIMonitor
 
+
+def parse_when(value):
+    # 'YYYY-MM-DD', an ISO datetime (UTC unless it has an offset) or a unix timestamp
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+def format_ts(ts):
+    return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M')
+
+
+def read_deposits(path):
+    # CSV with an 'amount' column and optional 'date' and 'note' columns.
+    # Returns (deposits, errors); nothing is written while any row is invalid.
+    deposits, errors = [], []
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        if "amount" not in (reader.fieldnames or []):
+            raise SystemExit(f"{path}: missing 'amount' column")
+        for line, row in enumerate(reader, start=2):
+            try:
+                deposit = {"amount": float(row["amount"])}
+                if row.get("date"):
+                    deposit["ts"] = parse_when(row["date"])
+                if row.get("note"):
+                    deposit["note"] = row["note"]
+            except (TypeError, ValueError) as e:
+                errors.append(f"line {line}: {e}")
+                continue
+            deposits.append(deposit)
+    return deposits, errors
+
+
+def describe(entry):
+    details = {k: v for k, v in entry.items() if k not in ("seq", "op", "ts")}
+    return " ".join(f"{k}={v}" for k, v in details.items())
+
+
+def print_balance(monitor, offline):
+    # Online runs bring the cost store up to date first (an incremental fetch)
+    if not offline:
+        monitor.refresh()
+    status = monitor.offline_status()
+    as_of = format_ts(status["as_of"]) if status["as_of"] else "never"
+    print(f"Balance: ${status['balance']:.2f} (deposited ${status['total_deposited']:.2f}, "
+          f"spent ${status['total_spend']:.2f}; costs fetched {as_of} UTC)")
+    return status
+
+
+def cmd_deposit(monitor, args):
+    deposit = {"amount": args.amount}
+    if args.date:
+        deposit["ts"] = parse_when(args.date)
+    if args.note:
+        deposit["note"] = args.note
+    monitor.add_deposits([deposit])
+    print(f"Successfully added ${args.amount:.2f} to the ledger.")
+    print_balance(monitor, args.offline)
+
+
+def cmd_import(monitor, args):
+    deposits, errors = read_deposits(args.file)
+    if errors:
+        print("\n".join(errors), file=sys.stderr)
+        print(f"{len(errors)} invalid rows; nothing imported.", file=sys.stderr)
+        return 1
+    undated = sum(1 for d in deposits if "ts" not in d)
+    if undated and not args.allow_undated:
+        # An undated row is recorded as made now, so a re-run could not recognise it
+        print(f"{undated} rows have no date and could be imported twice by a re-run; "
+              f"add dates or pass --allow-undated. Nothing imported.", file=sys.stderr)
+        return 1
+    if not args.allow_duplicates:
+        # Re-running an import must not double-count: dated rows already in the ledger are skipped
+        seen = {(round(e["ts"]), round(e["amount"], 2)) for e in monitor.ledger.entries() if e["op"] == "deposit"}
+        fresh = [d for d in deposits if "ts" not in d or (round(d["ts"]), round(d["amount"], 2)) not in seen]
+        if len(fresh) != len(deposits):
+            print(f"Skipping {len(deposits) - len(fresh)} deposits already in the ledger.")
+        deposits = fresh
+    if not deposits:
+        print("Nothing to import.")
+        return 0
+    total = sum(d["amount"] for d in deposits)
+    if args.dry_run:
+        print(f"Would import {len(deposits)} deposits totalling ${total:.2f}.")
+        return 0
+    monitor.add_deposits(deposits)
+    print(f"Imported {len(deposits)} deposits totalling ${total:.2f}.")
+    print_balance(monitor, args.offline)
+    return 0
+
+
+def cmd_list(monitor, args):
+    entries = monitor.ledger.entries()
+    if args.op:
+        entries = [e for e in entries if e["op"] == args.op]
+    if args.since:
+        since = parse_when(args.since)
+        entries = [e for e in entries if e["ts"] >= since]
+    if args.limit:
+        entries = entries[-args.limit:]
+    for entry in entries:
+        print(f"{entry['seq']:>6}  {format_ts(entry['ts'])}  {entry['op']:<10}  {describe(entry)}")
+    print(f"{len(entries)} entries")
+
+
+def cmd_replay(monitor, args):
+    # Rebuilds the ledger from its recorded entries, optionally only up to a point in time
+    until = parse_when(args.until) if args.until else None
+    state, first_seq = monitor.ledger.state_at(monitor._initial_ledger, seq=args.seq, ts=until)
+    for key in ("total_deposited", "start_date", "historical_spend", "last_alert_sent"):
+        print(f"{key}: {state[key]}")
+    if first_seq is not None and first_seq > 1:
+        print(f"Note: entries before #{first_seq} were compacted before history was kept; "
+              f"their effect is missing from this replay.")
+    if args.seq is None and until is None:
+        current = monitor.ledger.snapshot()
+        drift = current["total_deposited"] - state["total_deposited"]
+        if abs(drift) < 0.005:
+            print("Replay matches the current ledger.")
+        else:
+            print(f"Replay differs from the current ledger by ${drift:.2f} in total_deposited.")
+
+
+def cmd_reconcile(monitor, args):
+    # Month-by-month deposits (including sync adjustments) against stored spend
+    status = print_balance(monitor, args.offline)
+    state = monitor._initial_ledger()
+    deposited = {}
+    for entry in monitor.ledger.entries():
+        before = state["total_deposited"]
+        OPERATIONS[entry["op"]](state, entry)
+        month = datetime.utcfromtimestamp(entry["ts"]).strftime('%Y-%m')
+        deposited[month] = deposited.get(month, 0.0) + state["total_deposited"] - before
+    spent = {row["key"]: row["amount"] for row in status["history"]}
+    # Whatever the recorded entries do not explain (pre-history entries, a changed
+    # INITIAL_TOTAL_DEPOSITED) is shown as an opening adjustment
+    opening = status["total_deposited"] - sum(deposited.values())
+
+    print(f"\n{'Month':<8} {'Deposited':>12} {'Spent':>12} {'Balance':>12}")
+    running = opening
+    print(f"{'opening':<8} {opening:>12.2f} {'':>12} {running:>12.2f}")
+    for month in sorted(set(deposited) | set(spent)):
+        running += deposited.get(month, 0.0) - spent.get(month, 0.0)
+        print(f"{month:<8} {deposited.get(month, 0.0):>12.2f} {spent.get(month, 0.0):>12.2f} {running:>12.2f}")
+    unassigned = status["total_spend"] - sum(spent.values())
+    if abs(unassigned) >= 0.005:
+        print(f"Spend not attributed to a month (banked baseline): ${unassigned:.2f}")
+        running -= unassigned
+    print(f"Closing balance: ${running:.2f}")
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Manually add funds to the OpenAI Monitor Ledger.")
-    parser.add_argument("--amount", type=float, required=True, help="Amount to add (e.g., 50.00)")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--offline", action="store_true", default=argparse.SUPPRESS,
+                        help="Use only the local ledger and cost store; never call the OpenAI API")
+
+    parser = argparse.ArgumentParser(description="Manage the OpenAI Monitor ledger.", parents=[common])
+    parser.add_argument("--amount", type=float, help="Amount to add (e.g., 50.00); same as the deposit command")
+    commands = parser.add_subparsers(dest="command")
+
+    deposit = commands.add_parser("deposit", parents=[common], help="Add one deposit")
+    deposit.add_argument("amount", type=float)
+    deposit.add_argument("--date", help="When it was made (YYYY-MM-DD, ISO datetime or unix time); default now")
+    deposit.add_argument("--note")
+
+    bulk = commands.add_parser("import", parents=[common], help="Bulk-import deposits from a CSV (amount,date,note)")
+    bulk.add_argument("file")
+    bulk.add_argument("--dry-run", action="store_true", help="Validate and summarise without writing")
+    bulk.add_argument("--allow-duplicates", action="store_true",
+                      help="Import dated rows even if an identical deposit is already recorded")
+    bulk.add_argument("--allow-undated", action="store_true",
+                      help="Import rows without a date as made now (these are never de-duplicated)")
+
+    listing = commands.add_parser("list", parents=[common], help="List recorded ledger entries")
+    listing.add_argument("--op", choices=sorted(OPERATIONS))
+    listing.add_argument("--since", help="Only entries at or after this date")
+    listing.add_argument("--limit", type=int, help="Only the newest N entries")
+
+    replay = commands.add_parser("replay", parents=[common], help="Rebuild the ledger state from its entries")
+    replay.add_argument("--seq", type=int, help="Stop after this entry number")
+    replay.add_argument("--until", help="Only apply entries dated at or before this date")
+
+    commands.add_parser("reconcile", parents=[common], help="Compare deposits against stored spend by month")
+    commands.add_parser("balance", parents=[common], help="Print the current balance")
+
     args = parser.parse_args()
+    args.offline = getattr(args, "offline", False)
+    if args.command is None:
+        if args.amount is None:
+            parser.error("a command or --amount is required")
+        args.command, args.date, args.note = "deposit", None, None
 
     monitor = OpenAIMonitor()
-    monitor.add_deposit(args.amount)
-    print(f"Successfully added ${args.amount:.2f} to the ledger.")
-    status = monitor.get_balance()
-    print(f"New Estimated Balance: ${status['balance']:.2f}")
+    handlers = {
+        "deposit": cmd_deposit,
+        "import": cmd_import,
+        "list": cmd_list,
+        "replay": cmd_replay,
+        "reconcile": cmd_reconcile,
+        "balance": lambda monitor, args: print_balance(monitor, args.offline),
+    }
+    try:
+        result = handlers[args.command](monitor, args)
+    finally:
+        # Delivers anything queued before the process exits
+        monitor.dispatcher.close()
+    return result if isinstance(result, int) else 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
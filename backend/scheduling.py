@@ -0,0 +1,64 @@
+import os
+import time
+import random
+
+
+class AdaptivePoller:
+    """Decides when an org's balance should next be checked.
+
+    The delay is a fraction of the estimated time until the projected balance
+    reaches the alert threshold (headroom / burn rate), clamped to
+    [min_interval, max_interval]: a well-funded, idle org is checked rarely and
+    one close to its threshold every `min_interval`. Consecutive failed checks
+    back off exponentially with full jitter, up to `max_interval`.
+    """
+
+    def __init__(self, min_interval=60.0, max_interval=1800.0, headroom_fraction=0.1, error_base=60.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.headroom_fraction = headroom_fraction
+        self.error_base = error_base
+        self.failures = 0
+        self.interval = min_interval
+        # Check immediately after startup
+        self.next_at = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            min_interval=float(os.getenv("POLL_MIN_SECONDS", 60)),
+            max_interval=float(os.getenv("POLL_MAX_SECONDS", 1800)),
+            headroom_fraction=float(os.getenv("POLL_HEADROOM_FRACTION", 0.1)),
+        )
+
+    def due(self, now=None):
+        return (now if now is not None else time.time()) >= self.next_at
+
+    def delay_for(self, headroom, burn_per_hour):
+        # headroom in dollars above the threshold; burn in dollars per hour
+        if headroom <= 0:
+            return self.min_interval
+        if burn_per_hour <= 0:
+            return self.max_interval
+        seconds_left = headroom / burn_per_hour * 3600
+        return min(self.max_interval, max(self.min_interval, seconds_left * self.headroom_fraction))
+
+    def record_success(self, headroom, burn_per_hour, now=None):
+        self.failures = 0
+        self.interval = self.delay_for(headroom, burn_per_hour)
+        self.next_at = (now if now is not None else time.time()) + self.interval
+        return self.interval
+
+    def record_failure(self, now=None):
+        self.failures += 1
+        cap = min(self.max_interval, self.error_base * 2 ** (self.failures - 1))
+        self.interval = random.uniform(min(self.min_interval, cap), cap)
+        self.next_at = (now if now is not None else time.time()) + self.interval
+        return self.interval
+
+    def state(self):
+        return {
+            "interval": round(self.interval, 1),
+            "next_check_at": int(self.next_at),
+            "consecutive_failures": self.failures,
+        }
@@ -0,0 +1,454 @@
+"""Time-accelerated replay of the scheduler and alerting pipeline, fully offline.
+
+    python simulate.py                                      # 90 synthetic days from 2025-01-01
+    python simulate.py --days 365 --daily 40 --spike 2025-03-10:6 --deposit 2025-02-01:500
+    python simulate.py --trace export.csv --days 120 --json report.json
+    python simulate.py --throttle 2025-01-20T09:00:4h --budget-rules rules.json
+
+OpenAIMonitor runs against a virtual clock and an in-process stand-in for the
+Costs and Usage APIs, so months of scheduled checks take seconds and the same
+arguments always produce the same report: every alert queued and every ledger
+entry recorded. The trace is synthetic or a CSV from GET /api/export (day,amount
+or day,project_id,line_item,amount). No API key, network, SMTP or ledger.json in
+this directory is touched.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import logging
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+DAY = 86400
+HOUR = 3600
+SIM_BASE_URL = "http://trace.invalid/v1"
+# Usage is reported as uncached input tokens of this model, priced back by the monitor
+SIM_MODEL = "gpt-4o-mini"
+
+
+def parse_when(value):
+    # 'YYYY-MM-DD' or an ISO datetime, UTC unless it has an offset
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+def parse_duration(value):
+    # '90', '90s', '15m', '4h' or '2d'
+    units = {"s": 1, "m": 60, "h": HOUR, "d": DAY}
+    if value[-1:] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def parse_event(value):
+    # 'WHEN:VALUE'; WHEN may itself contain colons (ISO times), so split on the last one
+    when, _, rest = value.rpartition(":")
+    if not when:
+        raise argparse.ArgumentTypeError(f"expected WHEN:VALUE, got '{value}'")
+    return parse_when(when), rest
+
+
+def format_ts(ts):
+    return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d %H:%M')
+
+
+class SimClock:
+    """Virtual time: the monitor reads it, and client retry waits advance it instead of sleeping."""
+
+    def __init__(self, start):
+        self.now = float(start)
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+    def advance_to(self, ts):
+        self.now = max(self.now, float(ts))
+
+
+class SyntheticTrace:
+    """Deterministic daily spend per (project, line item): a base amount with weekly shape,
+    monthly growth, seeded noise and optional spike days."""
+
+    def __init__(self, first_day, daily=25.0, projects=3, line_items=("completions", "embeddings"),
+                 noise=0.2, weekend=0.6, growth=0.0, spikes=None, seed=0):
+        self.first_day = first_day
+        self.daily = daily
+        self.projects = [f"proj_{i + 1}" for i in range(projects)]
+        self.line_items = list(line_items)
+        self.noise = noise
+        self.weekend = weekend
+        self.growth = growth
+        self.spikes = spikes or {}
+        self.seed = seed
+        self._cache = {}
+
+    def items(self, day):
+        # [(project_id, line_item, amount)] for a day number
+        if day not in self._cache:
+            rng = random.Random(f"{self.seed}:{day}")
+            amount = self.daily * (1 + self.growth) ** ((day - self.first_day) / 30)
+            if (day + 3) % 7 >= 5:
+                amount *= self.weekend
+            amount *= max(0.0, 1 + rng.uniform(-self.noise, self.noise)) * self.spikes.get(day, 1.0)
+            # Earlier projects and line items take larger shares, so breakdowns are uneven
+            project_weights = [len(self.projects) - i for i in range(len(self.projects))]
+            item_weights = [len(self.line_items) - i for i in range(len(self.line_items))]
+            total_weight = sum(project_weights) * sum(item_weights)
+            self._cache[day] = [
+                (project, line_item, amount * pw * iw / total_weight)
+                for project, pw in zip(self.projects, project_weights)
+                for line_item, iw in zip(self.line_items, item_weights)
+            ]
+        return self._cache[day]
+
+
+class RecordedTrace:
+    """Daily spend read from an export CSV; days outside it have no spend."""
+
+    def __init__(self, path):
+        self.days = {}
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            if not {"day", "amount"} <= set(reader.fieldnames or []):
+                raise SystemExit(f"{path}: expected 'day' and 'amount' columns")
+            for row in reader:
+                day = int(parse_when(row["day"])) // DAY
+                self.days.setdefault(day, []).append(
+                    (row.get("project_id") or "", row.get("line_item") or "", float(row["amount"])))
+        if not self.days:
+            raise SystemExit(f"{path}: no rows")
+        self.first_day = min(self.days)
+
+    def items(self, day):
+        return self.days.get(day, [])
+
+
+class SimulatedAPI:
+    """Answers the Costs and Usage endpoints from a trace as of the virtual now.
+
+    Spend accrues evenly through each day. Cost buckets trail usage by `cost_lag`
+    seconds, so today's (and just after midnight yesterday's) bucket is partial and
+    gets revised, as upstream. Requests inside a throttle window get 429s.
+    """
+
+    def __init__(self, trace, clock, token_price, cost_lag=3 * HOUR, throttles=(), retry_after=30):
+        self.trace = trace
+        self.clock = clock
+        self.token_price = token_price
+        self.cost_lag = cost_lag
+        self.throttles = list(throttles)
+        self.retry_after = retry_after
+        self.requests = {}
+        self.throttled = 0
+
+    def _accrued(self, day, until):
+        # Fraction of a day's spend that has happened by `until`
+        return min(max((until - day * DAY) / DAY, 0.0), 1.0)
+
+    def handle(self, path, query):
+        endpoint = path.split("/v1/", 1)[-1]
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        now = self.clock()
+        if any(start <= now < end for start, end in self.throttles):
+            self.throttled += 1
+            return 429, {"error": {"message": "Rate limit exceeded"}}, {"Retry-After": str(self.retry_after)}
+        if endpoint == "organization/costs":
+            return 200, self._costs(query, now), {}
+        if endpoint.startswith("organization/usage/"):
+            return 200, self._usage(endpoint, query, now), {}
+        return 404, {"error": {"message": f"Unknown endpoint {endpoint}"}}, {}
+
+    def _costs(self, query, now):
+        start = int(query["start_time"][0])
+        end = int(query.get("end_time", [now + DAY])[0])
+        limit = int(query.get("limit", [7])[0])
+        day = -(-start // DAY)
+        last = min(-(-end // DAY), int(now) // DAY + 1)
+        data = []
+        while day < last and len(data) < limit:
+            fraction = self._accrued(day, now - self.cost_lag)
+            data.append({"object": "bucket", "start_time": day * DAY, "end_time": (day + 1) * DAY, "results": [
+                {"object": "organization.costs.result", "amount": {"value": round(amount * fraction, 6), "currency": "usd"},
+                 "project_id": project, "line_item": line_item}
+                for project, line_item, amount in self.trace.items(day)
+            ]})
+            day += 1
+        return {"object": "page", "data": data, "has_more": day < last, "next_page": None}
+
+    def _usage(self, endpoint, query, now):
+        start = int(query["start_time"][0]) // HOUR * HOUR
+        data = []
+        for bucket_start in range(start, int(now) + 1, HOUR):
+            results = []
+            if endpoint.endswith("/completions"):
+                day = bucket_start // DAY
+                spend = sum(amount for _, _, amount in self.trace.items(day)) / 24
+                spend *= min((now - bucket_start) / HOUR, 1.0)
+                results.append({"object": "organization.usage.completions.result", "model": SIM_MODEL,
+                                "input_tokens": round(spend * 1_000_000 / self.token_price),
+                                "input_cached_tokens": 0, "output_tokens": 0})
+            data.append({"object": "bucket", "start_time": bucket_start, "end_time": bucket_start + HOUR,
+                         "results": results})
+        return {"object": "page", "data": data, "has_more": False, "next_page": None}
+
+
+class TraceAdapter(BaseAdapter):
+    # Transport for the real ApiClient, so retries, Retry-After and metrics run unchanged
+
+    def __init__(self, api):
+        super().__init__()
+        self.api = api
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        status, payload, headers = self.api.handle(url.path, parse_qs(url.query))
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json", **headers})
+        response._content = json.dumps(payload).encode()
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingDispatcher:
+    """Stands in for AlertDispatcher: records each alert at the virtual time it was queued."""
+
+    channels = ()
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.results = []
+
+    def submit(self, alert):
+        alert = dict(alert, id=len(self.results) + 1, queued_at=self.clock())
+        self.results.append(alert)
+        return alert["id"]
+
+    def pending(self):
+        return 0
+
+    def close(self, timeout=10):
+        pass
+
+
+def alert_kind(alert):
+    rule = alert.get("rule")
+    if rule is None:
+        return "balance"
+    return "anomaly" if rule.startswith("anomaly:") else "budget"
+
+
+def write_ledger(path, deposited, start_date):
+    with open(path, "w") as f:
+        json.dump({
+            "total_deposited": deposited,
+            "start_date": start_date,
+            "historical_spend": 0.0,
+            "monthly_history": {},
+            "last_alert_sent": 0,
+            "rule_alerts": {},
+        }, f)
+
+
+def run(args, trace, start, end):
+    from http_client import ApiClient, TokenBucket
+    from monitor import OpenAIMonitor
+
+    clock = SimClock(start)
+    # Backoff and poll jitter come from the global RNG; seeding it makes runs repeatable
+    random.seed(args.seed)
+    client = ApiClient(base_url=SIM_BASE_URL, max_retries=args.max_retries, sleep=clock.sleep,
+                       rate_limiter=TokenBucket(1e9, 1e9))
+    # A reused workdir starts over, or the run would depend on what the previous one stored
+    for path in ("ledger.json", "ledger.json.journal", "ledger.json.history", "ledger.snapshot.json",
+                 "costs.db", "costs.db-wal", "costs.db-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    write_ledger("ledger.json", args.initial, int(start) // DAY * DAY - args.history_days * DAY)
+    monitor = OpenAIMonitor(ledger_file="ledger.json", store_file="costs.db", client=client,
+                            api_key="sk-admin-simulated", threshold=args.threshold,
+                            recipient_email="ops@localhost", dispatcher=RecordingDispatcher(clock), clock=clock)
+    # One window at a time, so the order of upstream requests (and 429s) never varies
+    monitor.backfill_workers = 1
+    price = monitor.prices.lookup(SIM_MODEL) or {"input": 1.0}
+    api = SimulatedAPI(trace, clock, price["input"], cost_lag=args.cost_lag, retry_after=args.retry_after,
+                       throttles=[(ts, ts + parse_duration(length)) for ts, length in args.throttle])
+    client.session.mount(SIM_BASE_URL, TraceAdapter(api))
+    # Proxy lookups in the environment would otherwise dominate the run time
+    client.session.trust_env = False
+
+    events = sorted([(ts, "deposit", float(v)) for ts, v in args.deposit] +
+                    [(ts, "sync", float(v)) for ts, v in args.sync])
+    months, checks, failures = {}, 0, []
+    while clock() < end:
+        while events and events[0][0] <= clock():
+            _, kind, amount = events.pop(0)
+            if kind == "deposit":
+                monitor.add_deposits([{"amount": amount, "note": "simulated"}])
+            else:
+                monitor.sync_balance(amount)
+        try:
+            status = monitor.check_if_due()
+        except Exception as e:
+            failures.append({"at": int(clock()), "error": str(e)})
+            status = None
+        if status is not None:
+            checks += 1
+            if monitor.poller.failures:
+                # Upstream errors were absorbed (the snapshot is partial or stale) and the poller backed off
+                failures.append({"at": int(clock()), "error": f"upstream errors, failure #{monitor.poller.failures}; "
+                                                             f"next check in {monitor.poller.interval:.0f}s"})
+            month = datetime.utcfromtimestamp(clock()).strftime('%Y-%m')
+            summary = months.setdefault(month, {"month": month, "checks": 0,
+                                                "lowest_projected": status["projected_balance"]})
+            summary["checks"] += 1
+            summary["lowest_projected"] = min(summary["lowest_projected"], status["projected_balance"])
+            summary.update(spend=status["monthly_usage"], balance=status["balance"])
+        # Jump to the scheduler tick on which the next check falls, or to the next event
+        wake = -(-max(monitor.poller.next_at, clock() + args.tick) // args.tick) * args.tick
+        if events:
+            wake = min(wake, events[0][0])
+        clock.advance_to(wake)
+
+    final = monitor.refresh()
+    alerts = [{
+        "at": int(alert["queued_at"]),
+        "kind": alert_kind(alert),
+        "subject": alert["subject"],
+        "balance": alert.get("balance"),
+        **({"rule": alert["rule"], "value": alert["value"]} if alert.get("rule") else {}),
+    } for alert in monitor.dispatcher.results]
+    ledger = [{"at": int(entry["ts"]), **{k: v for k, v in entry.items() if k != "ts"}}
+              for entry in monitor.ledger.entries()]
+    report = {
+        "start": int(start),
+        "end": int(end),
+        "checks": checks,
+        "failed_checks": failures,
+        "upstream": {"requests": api.requests, "throttled": api.throttled},
+        "alerts": alerts,
+        "ledger": ledger,
+        "months": list(months.values()),
+        "final": {key: final[key] for key in ("balance", "projected_balance", "total_deposited",
+                                              "total_spend", "monthly_usage")},
+    }
+    monitor.store.close()
+    monitor.ledger.close()
+    return report
+
+
+def print_report(report, elapsed):
+    timeline = [(a["at"], "alert", f"[{a['kind']}] {a['subject']}") for a in report["alerts"]]
+    for entry in report["ledger"]:
+        details = " ".join(f"{k}={round(v, 4) if isinstance(v, float) else v}"
+                           for k, v in entry.items() if k not in ("at", "seq", "op"))
+        timeline.append((entry["at"], entry["op"], details))
+    timeline += [(f["at"], "failure", f["error"]) for f in report["failed_checks"]]
+    for at, kind, text in sorted(timeline, key=lambda row: row[0]):
+        print(f"{format_ts(at)}  {kind:<11} {text}")
+
+    print(f"\n{'Month':<8} {'Checks':>7} {'Spend':>10} {'Balance':>10} {'Lowest':>10}")
+    for month in report["months"]:
+        print(f"{month['month']:<8} {month['checks']:>7} {month['spend']:>10.2f} {month['balance']:>10.2f} "
+              f"{month['lowest_projected']:>10.2f}")
+    upstream = report["upstream"]
+    days = (report["end"] - report["start"]) / DAY
+    print(f"\n{days:.0f} days simulated in {elapsed:.2f}s: {report['checks']} checks, "
+          f"{len(report['failed_checks'])} failed, {sum(upstream['requests'].values())} upstream requests "
+          f"({upstream['throttled']} throttled), {len(report['alerts'])} alerts, {len(report['ledger'])} ledger entries")
+    final = report["final"]
+    print(f"Final balance ${final['balance']:.2f} (projected ${final['projected_balance']:.2f}) after "
+          f"${final['total_spend']:.2f} spent of ${final['total_deposited']:.2f} deposited")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay months of monitoring against a virtual clock")
+    parser.add_argument("--start", help="first simulated day (default: the trace's first day, else 2025-01-01)")
+    parser.add_argument("--days", type=float, default=90, help="simulated days")
+    parser.add_argument("--trace", help="export CSV to replay instead of synthetic spend")
+    parser.add_argument("--daily", type=float, default=25.0, help="synthetic: average daily spend")
+    parser.add_argument("--projects", type=int, default=3, help="synthetic: number of projects")
+    parser.add_argument("--noise", type=float, default=0.2, help="synthetic: +/- fraction of random daily noise")
+    parser.add_argument("--growth", type=float, default=0.0, help="synthetic: spend growth per 30 days (0.1 = 10%%)")
+    parser.add_argument("--spike", action="append", type=parse_event, default=[], metavar="DAY:FACTOR",
+                        help="synthetic: multiply one day's spend (repeatable)")
+    parser.add_argument("--initial", type=float, default=3000.0, help="amount deposited before the start")
+    parser.add_argument("--history-days", type=int, default=30, help="days of spend before the start to backfill")
+    parser.add_argument("--deposit", action="append", type=parse_event, default=[], metavar="WHEN:AMOUNT",
+                        help="record a deposit at this time (repeatable)")
+    parser.add_argument("--sync", action="append", type=parse_event, default=[], metavar="WHEN:BALANCE",
+                        help="sync the ledger to a known balance at this time (repeatable)")
+    parser.add_argument("--throttle", action="append", type=parse_event, default=[], metavar="WHEN:LENGTH",
+                        help="answer every request with 429 for LENGTH (e.g. 2h) from WHEN (repeatable)")
+    parser.add_argument("--retry-after", type=int, default=30, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--max-retries", type=int, default=5, help="client retries per request")
+    parser.add_argument("--cost-lag", type=parse_duration, default=3 * HOUR,
+                        help="how far cost buckets trail usage (default 3h)")
+    parser.add_argument("--threshold", type=float, default=100.0, help="balance alert threshold")
+    parser.add_argument("--budget-rules", help="BUDGET_RULES_FILE to evaluate")
+    parser.add_argument("--tick", type=float, default=15.0, help="scheduler tick in seconds (POLL_TICK_SECONDS)")
+    parser.add_argument("--tz", default="UTC", help="time zone for quiet hours (default UTC)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="scratch directory (default: a new temporary one)")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the monitor's log")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # Configure before the monitor modules read their environment
+    os.environ["TZ"] = args.tz
+    time.tzset()
+    os.environ["BUDGET_RULES_FILE"] = os.path.abspath(args.budget_rules) if args.budget_rules else ""
+    for name in ("ORGS_CONFIG", "COST_STORE_FILE", "LEADER_LEASE_FILE", "INITIAL_TOTAL_DEPOSITED"):
+        os.environ.pop(name, None)
+
+    if args.trace:
+        trace = RecordedTrace(args.trace)
+        first_day = trace.first_day + args.history_days
+    else:
+        first_day = int(parse_when(args.start or "2025-01-01")) // DAY
+        trace = SyntheticTrace(first_day - args.history_days, daily=args.daily, projects=args.projects,
+                               noise=args.noise, growth=args.growth, seed=args.seed,
+                               spikes={int(ts) // DAY: float(factor) for ts, factor in args.spike})
+    start = parse_when(args.start) if args.start else first_day * DAY
+    end = start + args.days * DAY
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="monitor-sim-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    import monitor  # noqa: F401  (configures logging on import)
+    logging.getLogger("OpenAIMonitor").setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    started = time.perf_counter()
+    report = run(args, trace, start, end)
+    elapsed = time.perf_counter() - started
+    print(f"workdir  {workdir}\n")
+    print_report(report, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import sqlite3
+import threading
+from datetime import datetime
+import logging
+
+logger = logging.getLogger("OpenAIMonitor")
+
+
+def day_of(ts):
+    return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
+
+
+class CostStore:
+    """Embedded store of daily Costs API buckets, keyed by bucket start_time.
+
+    Buckets are upserted (never accumulated), so re-fetching a still-mutable day
+    replaces its previous value instead of adding to it.
+    """
+
+    def __init__(self, path="costs.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS daily_costs (
+                start_time INTEGER PRIMARY KEY,
+                end_time INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                amount REAL NOT NULL,
+                fetched_at INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_daily_costs_day ON daily_costs(day);
+            CREATE INDEX IF NOT EXISTS idx_daily_costs_fetched ON daily_costs(fetched_at);
+            CREATE TABLE IF NOT EXISTS line_item_costs (
+                start_time INTEGER NOT NULL,
+                project_id TEXT NOT NULL,
+                line_item TEXT NOT NULL,
+                cents REAL NOT NULL,
+                PRIMARY KEY (start_time, project_id, line_item)
+            );
+        """)
+        self._conn.commit()
+
+    def upsert_buckets(self, buckets, fetched_at):
+        # buckets: iterable of (start_time, end_time, amount, items) where items is a list of
+        # (project_id, line_item, amount). Returns how many daily totals changed.
+        changed = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            for start_t, end_t, amount, items in buckets:
+                cur.execute(
+                    """
+                    INSERT INTO daily_costs (start_time, end_time, day, amount, fetched_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(start_time) DO UPDATE SET
+                        end_time = excluded.end_time,
+                        amount = excluded.amount,
+                        fetched_at = excluded.fetched_at
+                    WHERE daily_costs.amount != excluded.amount
+                       OR daily_costs.end_time != excluded.end_time
+                    """,
+                    (int(start_t), int(end_t), day_of(start_t), float(amount), int(fetched_at)),
+                )
+                changed += cur.rowcount
+                # A day's set of line items can change while it is mutable, so replace it wholesale
+                cur.execute("DELETE FROM line_item_costs WHERE start_time = ?", (int(start_t),))
+                cur.executemany(
+                    "INSERT INTO line_item_costs (start_time, project_id, line_item, cents) VALUES (?, ?, ?, ?)",
+                    [(int(start_t), project, line_item, value * 100) for project, line_item, value in items],
+                )
+            self._conn.commit()
+        return changed
+
+    def _stream(self, sql, params, batch_size):
+        # Uses its own connection (WAL allows concurrent readers) so long scans never hold
+        # the writer lock, and fetches in batches so memory stays flat for any range. Streaming
+        # responses advance the generator from whichever pool thread is free, hence no thread check.
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cur = conn.execute(sql, params)
+            rows = cur.fetchmany(batch_size)
+            while rows:
+                yield from rows
+                rows = cur.fetchmany(batch_size)
+        finally:
+            conn.close()
+
+    def iter_line_items(self, since=0, until=None, batch_size=1000):
+        # Yields (start_time, project_id, line_item, cents) in time order
+        return self._stream(
+            """
+            SELECT start_time, project_id, line_item, cents FROM line_item_costs
+            WHERE start_time >= ? AND start_time < ? ORDER BY start_time
+            """,
+            (int(since), int(until) if until is not None else 2 ** 62),
+            batch_size,
+        )
+
+    def iter_export(self, since, until, group_by=(), batch_size=1000):
+        # Yields (day, *group_values, amount) per day in [since, until), oldest first. Without
+        # group_by these are the daily totals; otherwise line items summed per group.
+        for key in group_by:
+            if key not in ("project_id", "line_item"):
+                raise ValueError(f"Unknown group_by key '{key}'")
+        if group_by:
+            columns = "".join(f", {key}" for key in group_by)
+            sql = f"""
+                SELECT date(start_time, 'unixepoch') AS day{columns}, SUM(cents) / 100.0 FROM line_item_costs
+                WHERE start_time >= ? AND start_time < ?
+                GROUP BY start_time{columns} ORDER BY start_time{columns}
+            """
+        else:
+            sql = """
+                SELECT day, amount FROM daily_costs
+                WHERE start_time >= ? AND start_time < ? ORDER BY start_time
+            """
+        return self._stream(sql, (int(since), int(until)), batch_size)
+
+    def last_end_before(self, ts):
+        # End of the newest stored bucket that closed at or before ts (i.e. is settled)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(end_time) FROM daily_costs WHERE end_time <= ?", (int(ts),)
+            ).fetchone()
+        return row[0]
+
+    def last_fetched_at(self):
+        # When the store last received buckets, or None if it is empty
+        with self._lock:
+            return self._conn.execute("SELECT MAX(fetched_at) FROM daily_costs").fetchone()[0]
+
+    def first_fetched_since(self, fetched_at):
+        # Start of the oldest bucket written at or after fetched_at, or None
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(start_time) FROM daily_costs WHERE fetched_at >= ?", (int(fetched_at),)
+            ).fetchone()[0]
+
+    def total(self, since=0):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(amount), 0.0) FROM daily_costs WHERE start_time >= ?", (int(since),)
+            ).fetchone()
+        return row[0]
+
+    def range_total(self, first_day, last_day, since=0):
+        # Inclusive range of 'YYYY-MM-DD' days, served by the day index
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT COALESCE(SUM(amount), 0.0) FROM daily_costs
+                WHERE day >= ? AND day <= ? AND start_time >= ?
+                """,
+                (first_day, last_day, int(since)),
+            ).fetchone()
+        return row[0]
+
+    def monthly_totals(self, since=0):
+        # {'YYYY-MM': amount}
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT substr(day, 1, 7) AS month, SUM(amount) FROM daily_costs
+                WHERE start_time >= ? GROUP BY month
+                """,
+                (int(since),),
+            ).fetchall()
+        return dict(rows)
+
+    def daily_series(self, since=0, until=None):
+        # [(start_time, amount)] of buckets that closed by `until`, oldest first
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT start_time, amount FROM daily_costs
+                WHERE start_time >= ? AND end_time <= ? ORDER BY start_time
+                """,
+                (int(since), int(until) if until is not None else 2 ** 62),
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+from budgets import BudgetEngine, BudgetRule
+from monitor import OpenAIMonitor
+
+DAY = 86400
+# 2025-01-08: neither it nor the next day starts a month
+BREACH_DAY = 1_736_121_600 // DAY * DAY + 2 * DAY
+DEFAULTS = {"throttle_seconds": 7200, "quiet_hours": "off"}
+
+
+class ListDispatcher:
+    def __init__(self):
+        self.alerts = []
+
+    def submit(self, alert):
+        self.alerts.append(alert)
+        return len(self.alerts)
+
+
+def _bucket(start_t, amount):
+    return (start_t, start_t + DAY, amount, [("proj_1", "completions", amount)])
+
+
+def test_breach_that_lands_after_rollover_is_evaluated():
+    engine = BudgetEngine([BudgetRule({"name": "daily", "period": "day", "above": 22}, DEFAULTS)])
+    # Shortly before midnight the lagging bucket is still under the limit
+    engine.update_days([_bucket(BREACH_DAY, 20.0)], BREACH_DAY + DAY - 60)
+    assert engine.evaluate(BREACH_DAY + DAY - 60, settle_days=2) == []
+    # Its last hours arrive after the day rolled over
+    now = BREACH_DAY + DAY + 3 * 3600
+    engine.update_days([_bucket(BREACH_DAY, 25.0)], now)
+    assert engine.evaluate(now) == []
+    breaches = engine.evaluate(now, settle_days=2)
+    assert [(b["period"], b["current"]) for b in breaches] == [("2025-01-08", False)]
+    # Once outside the settle window it is no longer checked
+    assert engine.evaluate(BREACH_DAY + 3 * DAY + 60, settle_days=2) == []
+
+
+def test_closed_period_alerts_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        now = [BREACH_DAY + DAY + 3 * 3600]
+        dispatcher = ListDispatcher()
+        monitor = OpenAIMonitor(ledger_file=os.path.join(tmp, "ledger.json"),
+                                store_file=os.path.join(tmp, "costs.db"), api_key="sk-test",
+                                dispatcher=dispatcher, clock=lambda: now[0])
+        monitor.budgets = BudgetEngine([BudgetRule({"name": "daily", "period": "day", "above": 22}, DEFAULTS)])
+        monitor.budgets.update_days([_bucket(BREACH_DAY, 25.0)], now[0])
+        assert monitor.check_budgets() == ["daily"]
+        assert "on 2025-01-08" in dispatcher.alerts[0]["subject"]
+        # Well past the throttle, the closed day stays quiet
+        now[0] += 6 * 3600
+        assert monitor.check_budgets() == []
+        assert len(dispatcher.alerts) == 1
+        monitor.store.close()
+        monitor.ledger.close()
+
+
+if __name__ == "__main__":
+    test_breach_that_lands_after_rollover_is_evaluated()
+    test_closed_period_alerts_once()
+    print("OK")
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import tempfile
+
+from starlette.concurrency import iterate_in_threadpool
+
+from export import encode_rows, export_columns
+from store import CostStore
+
+DAYS = 1500
+START = 1_600_000_000 // 86400 * 86400
+
+
+def _filled_store(path):
+    store = CostStore(path)
+    store.upsert_buckets(
+        [(START + d * 86400, START + (d + 1) * 86400, d / 10, [("proj_1", "completions", d / 10)])
+         for d in range(DAYS)],
+        START + DAYS * 86400,
+    )
+    return store
+
+
+async def _export(store):
+    # Advanced the way StreamingResponse does: each next() may land on a different pool thread
+    rows = store.iter_export(START, START + DAYS * 86400, batch_size=100)
+    chunks = [chunk async for chunk in iterate_in_threadpool(encode_rows(rows, export_columns([]), "csv", 50))]
+    return "".join(chunks)
+
+
+def test_concurrent_exports_arrive_complete():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _filled_store(os.path.join(tmp, "costs.db"))
+
+        async def run():
+            return await asyncio.gather(*(_export(store) for _ in range(12)))
+
+        bodies = asyncio.run(run())
+        lines = bodies[0].splitlines()
+        assert lines[0] == "day,amount"
+        assert len(lines) == DAYS + 1
+        assert all(body == bodies[0] for body in bodies)
+
+
+if __name__ == "__main__":
+    test_concurrent_exports_arrive_complete()
+    print("OK")
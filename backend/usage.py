@@ -0,0 +1,90 @@
+import json
+import threading
+import logging
+
+logger = logging.getLogger("OpenAIMonitor")
+
+# Token-billed usage endpoints polled for intraday estimates
+USAGE_ENDPOINTS = ("completions", "embeddings")
+# Largest page the usage API accepts for each bucket width
+PAGE_LIMITS = {"1m": 1440, "1h": 168}
+BUCKET_SECONDS = {"1m": 60, "1h": 3600}
+
+
+class PriceTable:
+    """USD per 1M tokens by model, matched on the longest model-name prefix.
+
+    Dated snapshots such as 'gpt-4o-2024-08-06' therefore use the 'gpt-4o' row.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+        self._prefixes = sorted(prices, key=len, reverse=True)
+        self._unpriced = set()
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, "r") as f:
+                return cls(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading price table {path}: {e}")
+            return cls({})
+
+    def lookup(self, model):
+        for prefix in self._prefixes:
+            if model and model.startswith(prefix):
+                return self.prices[prefix]
+        if model not in self._unpriced:
+            self._unpriced.add(model)
+            logger.warning(f"No price for model '{model}'; its usage is not included in spend estimates")
+        return None
+
+    def estimate(self, result):
+        price = self.lookup(result.get("model"))
+        if price is None:
+            return 0.0
+        cached = result.get("input_cached_tokens") or 0
+        uncached = (result.get("input_tokens") or 0) - cached
+        cost = uncached * price.get("input", 0.0)
+        cost += cached * price.get("cached_input", price.get("input", 0.0))
+        cost += (result.get("output_tokens") or 0) * price.get("output", 0.0)
+        return cost / 1_000_000
+
+
+class BurnRateWindow:
+    """Estimated spend per usage bucket over a rolling window, in memory only.
+
+    Re-adding a bucket replaces its previous estimate, since the newest bucket is
+    still filling up when it is fetched.
+    """
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # bucket_start -> {endpoint: estimated USD}
+        self._buckets = {}
+
+    def set(self, bucket_start, endpoint, cost):
+        with self._lock:
+            self._buckets.setdefault(bucket_start, {})[endpoint] = cost
+
+    def prune(self, now):
+        # Keep today's buckets as well as the rate window: both feed the projection
+        horizon = min(now - self.window_seconds, now // 86400 * 86400)
+        with self._lock:
+            for start in [s for s in self._buckets if s < horizon]:
+                del self._buckets[start]
+
+    def spend_between(self, start, end):
+        with self._lock:
+            return sum(sum(costs.values()) for s, costs in self._buckets.items() if start <= s < end)
+
+    def closed_buckets(self, after, now, width):
+        # [(bucket_start, estimated USD)] for buckets newer than `after` that ended by `now`
+        with self._lock:
+            return sorted((s, sum(costs.values())) for s, costs in self._buckets.items()
+                          if s > after and s + width <= now)
+
+    def rate_per_hour(self, now):
+        return self.spend_between(now - self.window_seconds, now) * 3600 / self.window_seconds
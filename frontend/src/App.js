@@ -8,6 +8,7 @@ import './App.css';
 
 function App() {
   const [status, setStatus] = useState(null);
+  const [history, setHistory] = useState([]);
   const [loading, setLoading] = useState(true);
   const [message, setMessage] = useState('');
   const [lastUpdated, setLastUpdated] = useState(null);
@@ -16,19 +17,77 @@ function App() {
     try {
       const res = await axios.get('/api/status');
       setStatus(res.data);
-      setLastUpdated(new Date());
+      // as_of is when the backend snapshot was computed, not when we polled it
+      setLastUpdated(res.data.as_of ? new Date(res.data.as_of * 1000) : new Date());
       setLoading(false);
     } catch (err) {
+      if (err.response && err.response.status === 503) {
+        // Backend is still starting up; it answers from its last snapshot within seconds
+        setTimeout(fetchStatus, 1000);
+        return;
+      }
       console.error(err);
       setMessage('Failed to fetch status. Backend might be down.');
       setLoading(false);
     }
   };
 
+  const fetchHistory = async () => {
+    try {
+      const res = await axios.get('/api/history', { params: { limit: 500 } });
+      setHistory(res.data.items);
+    } catch (err) {
+      if (err.response && err.response.status === 503) {
+        setTimeout(fetchHistory, 1000);
+        return;
+      }
+      console.error(err);
+    }
+  };
+
+  const applyHistoryDelta = (prev, { history_updates, history_removed }) => {
+    const months = new Map(prev.map(row => [row.key, row]));
+    (history_removed || []).forEach(key => months.delete(key));
+    (history_updates || []).forEach(row => months.set(row.key, row));
+    // Keys are 'YYYY-MM', so a string sort keeps newest first
+    return Array.from(months.values()).sort((a, b) => b.key.localeCompare(a.key));
+  };
+
   useEffect(() => {
     fetchStatus();
-    const interval = setInterval(fetchStatus, 10000); 
-    return () => clearInterval(interval);
+    fetchHistory();
+    // The backend pushes a full snapshot on connect, then small deltas only when a refresh changes something
+    let source;
+    let retry;
+    const connect = () => {
+      source = new EventSource('/api/stream');
+      source.onerror = () => {
+        // EventSource gives up on non-200 answers (e.g. 503 during startup), so reconnect ourselves
+        if (source.readyState === EventSource.CLOSED) {
+          retry = setTimeout(connect, 2000);
+        }
+      };
+      source.addEventListener('snapshot', (e) => {
+        const data = JSON.parse(e.data);
+        setStatus(data);
+        setLastUpdated(new Date(data.as_of * 1000));
+        setLoading(false);
+      });
+      source.addEventListener('delta', (e) => {
+        const delta = JSON.parse(e.data);
+        const { history_updates, history_removed, ...fields } = delta.changes;
+        setStatus(prev => (prev ? { ...prev, ...fields, revision: delta.revision, as_of: delta.as_of } : prev));
+        if (history_updates || history_removed) {
+          setHistory(prev => applyHistoryDelta(prev, { history_updates, history_removed }));
+        }
+        setLastUpdated(new Date(delta.as_of * 1000));
+      });
+    };
+    connect();
+    return () => {
+      clearTimeout(retry);
+      source.close();
+    };
   }, []);
 
   const handleSync = async (amount) => {
@@ -36,6 +95,7 @@ function App() {
       await axios.post('/api/sync', { amount });
       setMessage('Balance synced successfully!');
       fetchStatus();
+      fetchHistory();
       setTimeout(() => setMessage(''), 3000);
     } catch (err) {
       setMessage('Error syncing balance.');
@@ -68,6 +128,7 @@ function App() {
           <div className="header-brand">
             <h1>OpenAI Monitor</h1>
             <span className="badge-beta">PRO</span>
+            {status && status.warming && <span className="badge-warming">Catching up…</span>}
           </div>
         </header>
 
@@ -86,7 +147,7 @@ function App() {
               lastUpdated={lastUpdated} 
             />
 
-            <HistoryTable history={status.history} />
+            <HistoryTable history={history} />
           </div>
         )}
 